@@ -0,0 +1,475 @@
+'''This file contains a vectorised variant of the protocol execution
+function, which executes a protocol on many gossip graphs at once by
+advancing all trials in lockstep using NumPy arrays.'''
+
+# Install modules
+import networkx as nx
+import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.rcParams["figure.dpi"] = 150
+import numpy as np
+from math import factorial
+import random
+import time
+import copy
+import pickle
+
+# ===============================================================
+#  Useful tools
+# ===============================================================
+
+# Sets of agents of a batch (secrets, contacts and numbers) are packed
+# into rows of W = ceil(n/64) unsigned 64-bit words, where bit k % 64 of
+# word k // 64 is set if agent k is in the set, so two sets are merged
+# with W ors rather than n.
+
+# packBitsets(bitsets, W) - packs bitsets into rows of words
+# Parameters: bitsets - list of ints, bitsets of agents
+#             W - int, number of 64-bit words per row
+# Returns: NumPy array of uint64 of shape (len(bitsets), W)
+
+def packBitsets(bitsets, W):
+    data = b''.join(b.to_bytes(8 * W, 'little') for b in bitsets)
+    return np.frombuffer(data, dtype='<u8').reshape(len(bitsets), W)
+
+
+# unpackWords(words, n) - unpacks rows of words into boolean rows
+# Parameters: words - NumPy array of uint64, with rows of W words in its
+#                     last axis
+#             n - int, number of agents
+# Returns: boolean NumPy array, the last axis of words replaced by n 
+#          entries, entry k true iff agent k is in the set
+
+def unpackWords(words, n):
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), 
+                         axis=-1, bitorder='little')
+    return bits[..., :n].astype(bool)
+
+
+# unpackBitsets(words) - unpacks rows of words into bitsets
+# Parameters: words - 2D NumPy array of uint64, one row of W words per
+#                     set
+# Returns: list of ints, the bitset of each row
+
+def unpackBitsets(words):
+    return [int.from_bytes(row.tobytes(), 'little') for row in words]
+
+
+# wordBit(k) - locates agent k in a row of words
+# Parameters: k - NumPy array of ints, agent indices
+# Returns: tuple (word, bit), NumPy arrays of the word of each agent and
+#          the uint64 with only its bit set
+
+def wordBit(k):
+    return (k >> 6, np.left_shift(np.uint64(1), (k & 63).astype(np.uint64)))
+
+
+# selectColumns(rows, r) - finds the r-th true entry of each row
+# Parameters: rows - 2D boolean NumPy array
+#             r - NumPy array of ints, 0 <= r < number of true entries 
+#                 of the row (counting from 0)
+# Returns: NumPy array of ints, the column of the r-th true entry of
+#          each row
+
+def selectColumns(rows, r):
+    return (np.cumsum(rows, axis=1) <= r[:, None]).sum(axis=1)
+
+
+# rowsDiffer(words) - compares the rows of words of each trial
+# Parameters: words - 3D NumPy array of uint64 (one (n x W) matrix of
+#                     packed sets per trial)
+# Returns: 3D boolean NumPy array, entry (t,a,b) true iff the sets of
+#          agents a and b of trial t differ
+
+def rowsDiffer(words):
+    differ = words[:, :, None, 0] != words[:, None, :, 0]
+    for w in range(1, words.shape[2]):
+        differ |= words[:, :, None, w] != words[:, None, :, w]
+    return differ
+
+
+# ===============================================================
+#  Protocol execution function (vectorised over trials)
+# ===============================================================
+
+# Number of running trials at or below which a batch may finish its 
+# trials one at a time (a lockstep step costs about as much as this many
+# sequential calls)
+TAIL = 16
+
+# continueState(S, secrets, contacts, token, numbers, adj) - GossipState
+#          holding the state of a trial of a batch, from which its 
+#          execution is continued by executeProtocol
+# Parameters: S - GossipState the trial started from (not modified)
+#             secrets, contacts, numbers - 2D NumPy arrays of packed
+#                                          sets of the trial (contacts 
+#                                          None unless tracked, numbers
+#                                          None unless dynamic)
+#             token - boolean NumPy array, token holders of the trial
+#             adj - 2D boolean NumPy array, arcs of the trial
+# Returns: GossipState, a copy of S updated with the state of the trial
+
+def continueState(S, secrets, contacts, token, numbers, adj):
+    T = copy.copy(S)
+    T.initial = False
+    T.secrets = unpackBitsets(secrets)
+    T.contacts = (S.contacts.copy() if contacts is None 
+                  else unpackBitsets(contacts))
+    T.token = bytearray(token.astype(np.uint8).tobytes())
+    T.numbers = (S.numbers.copy() if numbers is None
+                 else unpackBitsets(numbers))
+    T.unknown, T.learned = None, None
+    
+    # Arcs added in the batch (dynamic case), after the existing arcs
+    if (S.dynamic):
+        T.adj, T.out = [], []
+        for agent in range(S.n):
+            row = np.packbits(adj[agent], bitorder='little').tobytes()
+            out = int.from_bytes(row, 'little')
+            new = list(bitsetMembers(out & ~S.out[agent]))
+            T.adj.append(S.adj[agent] + new)
+            T.out.append(out)
+            T.added = T.added + len(new)
+    return T
+
+
+# executeBatch(graphs, P, budget, timeLimit) - executes protocol P on 
+#                                              each of the given gossip
+#                                              graphs, all trials 
+#                                              advancing in lockstep (one
+#                                              call per trial per step)
+# Parameters: graphs - list of graph objects (or GossipStates) on the
+#                      same number of agents, generated in
+#                      "graph_generator.py", one per trial
+#             P - predefined protocol function (ANY, CO, LNS, TOK
+#                 or SPI)
+#             budget - int, maximum number of calls of each trial before
+#                      it times out (None uses defaultBudget(n))
+#             timeLimit - float, optional limit in seconds on the shared
+#                         time of the batch, after which all running 
+#                         trials time out (None for no limit)
+# Returns: list of tuples (c, timer, success, failure, timeout), one per
+#          trial, as returned by executeProtocol. The time of a trial
+#          is the elapsed time of the batch when the trial terminated,
+#          shared equally between all trials of the batch.
+#
+# The secrets, contacts and numbers of all K trials are held in packed
+# (K x n x W) word arrays and the arcs in a (K x n x n) boolean array
+# (with the permitted calls under CO and LNS, and the neighbour lists 
+# under ANY, TOK and SPI). The number of permitted calls of each agent (its 
+# weight) is kept together with running prefix sums over the agents of 
+# each trial, offset by trial so that they increase across the whole
+# batch. A caller is then picked in every trial, with probability 
+# proportional to its weight, by one binary search of the offset sums,
+# and a callee uniformly among its permitted calls (straight from its 
+# neighbour list under ANY, TOK and SPI). A call only
+# changes the weights of its two agents, so only those are updated, and
+# only in trials where they changed (never under ANY on static graphs).
+# All chosen calls are executed with vectorised ors of the packed sets,
+# and in the dynamic case new arcs are only unpacked in trials where an
+# agent learned a number it has no arc to. Every n steps, CO and SPI
+# trials where no permitted call can spread knowledge fail (see stuck in
+# "protocols.py"). Once at most TAIL trials are running and they have 
+# made twice the average length of the finished trials, they are in the
+# tail of the length distribution (e.g. on dynamic graphs, where a few 
+# trials run for ten times the average), so each is continued from its
+# state by executeProtocol rather than paying a whole step per call. The
+# graphs are not modified.
+
+def executeBatch(graphs, P, budget = None, timeLimit = None):
+    # Fetch compact states of the graphs
+    states = [G if isinstance(G, GossipState) else GossipState(G)
+              for G in graphs]
+    K, n = len(states), states[0].n
+    W = (n + 63)//64
+    dynamic = states[0].dynamic
+    
+    # Arcs of implicit complete graphs are never materialised
+    if (any(S.implicit for S in states)):
+        raise ValueError("batch execution requires stored arcs (not "
+                         "implicit complete graphs)")
+    
+    # Maximum number of calls of each trial
+    if (budget is None):
+        budget = defaultBudget(n)
+
+    # Random generator (seeded from random, so random.seed applies)
+    rng = np.random.default_rng(random.getrandbits(64))
+
+    # Arcs, known secrets and tokens of each trial (secrets packed)
+    adj = np.zeros((K, n, n), dtype=bool)
+    know = np.zeros((K, n, W), dtype=np.uint64)
+    token = np.zeros((K, n), dtype=bool)
+    for t, S in enumerate(states):
+        # Arcs from the CSR adjacency (or the lists, if arcs were added)
+        if (S.added == 0):
+            callers = np.repeat(np.arange(n), np.diff(S.indptr))
+            adj[t, callers, S.indices] = True
+        else:
+            arcs = np.array(S.arcs(), dtype=np.int64).reshape(-1, 2)
+            adj[t, arcs[:, 0], arcs[:, 1]] = True
+        know[t] = packBitsets(S.secrets, W)
+        token[t] = np.frombuffer(S.token, dtype=np.uint8).astype(bool)
+    degrees = adj.sum(axis=2)
+    full = packBitsets([states[0].full], W)[0]
+
+    # Contacts (CO) and numbers (dynamic case) of each trial (packed)
+    contacts, numbers = None, None
+    if (P == CO):
+        contacts = np.stack([packBitsets(S.contacts, W) for S in states])
+    if (dynamic):
+        numbers = np.stack([packBitsets(S.numbers, W) for S in states])
+        # Arcs of each agent (packed), to find new arcs
+        out = np.stack([packBitsets([S.outBits(agent) 
+                                     for agent in range(n)], W)
+                        for S in states])
+
+    # Neighbour lists (ANY, TOK and SPI), from which the callee of a 
+    # caller, which may call all its neighbours, is drawn directly (in
+    # the dynamic case new arcs are appended, so there is room for n-1)
+    listed = P in (ANY, TOK, SPI)
+    if (listed):
+        (ts, agents, ks) = np.nonzero(adj)
+        starts = np.cumsum(degrees.ravel()) - degrees.ravel()
+        position = np.arange(len(ks)) - np.repeat(starts, degrees.ravel())
+        width = n - 1 if dynamic else degrees.max()
+        neighbours = np.zeros((K, n, max(1, width)), dtype=np.int32)
+        neighbours[ts, agents, position] = ks
+
+    # Permitted calls (CO and LNS, initially all arcs) and the number of
+    # permitted calls of each agent (its weight)
+    permitted = None
+    if (P == CO or P == LNS):
+        permitted = adj.copy()
+        weights = degrees.copy()
+    elif (P == TOK or P == SPI):
+        weights = degrees * token
+    else:
+        weights = degrees.copy()
+
+    # Prefix sums of the weights of each trial, offset by M per trial
+    # (more than any sum), and total weight of each trial
+    M = n * n + 1
+    offsets = np.arange(K, dtype=np.int64) * M
+    cumulative = np.cumsum(weights, axis=1) + offsets[:, None]
+    flat = cumulative.ravel()
+    totals = weights.sum(axis=1)
+    columns = np.arange(n)
+
+    # Expert agents of each trial
+    expert = (know == full).all(axis=2)
+    experts = expert.sum(axis=1)
+
+    # Results of each trial, and number of calls made by every running
+    # trial (all running trials make one call per step)
+    results = [None] * K
+    c = 0
+    
+    # Total length of the finished trials
+    finished = 0
+
+    # Indices of trials still running
+    active = np.arange(K)
+    running = K
+
+    # Record initial time
+    initTime = time.perf_counter()
+    timer = 0
+
+    # Execute protocol (each loop corresponds to one call in every
+    # active trial)
+    while (len(active) != 0):
+        # Trials where all agents are experts succeed
+        done = experts[active] == n
+        if (done.any()):
+            for t in active[done]:
+                results[t] = (c, timer, True, False, False)
+            active = active[~done]
+
+        # Trials with no permitted calls fail
+        done = totals[active] == 0
+        if (done.any()):
+            for t in active[done]:
+                results[t] = (c, timer, False, True, False)
+            active = active[~done]
+
+        # Trials where no permitted call joins agents with different
+        # secrets (or numbers) fail (CO and SPI, every n steps)
+        if ((P == CO or P == SPI) and len(active) != 0 and
+            c % n == 0 and c != 0):
+            differ = rowsDiffer(know[active])
+            if (dynamic):
+                differ |= rowsDiffer(numbers[active])
+            if (P == CO):
+                calls = permitted[active]
+            else:
+                calls = adj[active] & token[active][:, :, None]
+            done = ~(calls & differ).any(axis=(1, 2))
+            for t in active[done]:
+                results[t] = (c, timer, False, True, False)
+            active = active[~done]
+
+        # Trials that spent their call budget time out
+        if (len(active) != 0 and c >= budget):
+            for t in active:
+                results[t] = (c, timer, False, False, True)
+            break
+
+        if (len(active) == 0):
+            break
+
+        # Continue the last few trials one at a time, once they are
+        # much longer than the finished trials
+        finished += c * (running - len(active))
+        running = len(active)
+        if (running <= TAIL and c * (K - running) > 2 * finished):
+            for t in active:
+                S = continueState(states[t], know[t], contacts[t] if 
+                                  (P == CO) else None, token[t], 
+                                  numbers[t] if dynamic else None, adj[t])
+                limit = None if timeLimit is None else timeLimit - timer
+                (length, elapsed, success, failure, timeout) = (
+                    executeProtocol(S, P, False, budget - c, limit))
+                results[t] = (c + length, timer + elapsed, success, 
+                              failure, timeout)
+            break
+
+        # Select caller i in each trial, weighted by its permitted calls
+        # (the first agent whose offset prefix sum exceeds r)
+        u = rng.random((2, len(active)))
+        r = (u[0] * totals[active]).astype(np.int64)
+        i = np.searchsorted(flat, offsets[active] + r, side='right')
+        i -= active * n
+        
+        # Select callee j uniformly among the permitted calls of i
+        count = weights[active, i]
+        r = (u[1] * count).astype(np.int64)
+        if (listed):
+            j = neighbours[active, i, r].astype(np.int64)
+        else:
+            j = selectColumns(permitted[active, i], r)
+        
+        # Weights of i and j before the call (ANY updates its weights
+        # with the arcs)
+        if (P != ANY):
+            before = (count, weights[active, j])
+
+        # Exchange secrets
+        knowI, knowJ = know[active, i], know[active, j]
+        secrets = knowI | knowJ
+        know[active, i] = secrets
+        know[active, j] = secrets
+
+        # Count new experts
+        isFull = (secrets == full).all(axis=1)
+        experts[active] += ((isFull & ~expert[active, i]).astype(int) +
+                            (isFull & ~expert[active, j]).astype(int))
+        expert[active, i] = isFull
+        expert[active, j] = isFull
+
+        # Add each agent to each others past contacts
+        if (P == CO):
+            (word, bit) = wordBit(j)
+            contacts[active, i, word] |= bit
+            (word, bit) = wordBit(i)
+            contacts[active, j, word] |= bit
+
+        # Exchange tokens
+        # TOK
+        if (P == TOK):
+            token[active, i] = False
+            token[active, j] = True
+        # SPI
+        if (P == SPI):
+            token[active, j] = False
+
+        # Update arcs in dynamic case
+        if (dynamic):
+            # Update phone number lists
+            known = numbers[active, i] | numbers[active, j]
+            numbers[active, i] = known
+            numbers[active, j] = known
+
+            # Add new arcs of caller, then callee
+            for agent in (i, j):
+                # Numbers the agent has no arc to (other than its own)
+                (word, bit) = wordBit(agent)
+                new = known & ~out[active, agent]
+                new[np.arange(len(active)), word] &= ~bit
+                
+                # Trials where the agent has new arcs
+                rows = new.any(axis=1)
+                if (not rows.any()):
+                    continue
+                (t, a) = (active[rows], agent[rows])
+                out[t, a] |= new[rows]
+                new = unpackWords(new[rows], n)
+                adj[t, a] |= new
+                added = new.sum(axis=1)
+                
+                # Append the new arcs to the neighbour lists
+                if (listed):
+                    (r, k) = np.nonzero(new)
+                    rank = np.cumsum(new, axis=1)[r, k] - 1
+                    neighbours[t[r], a[r], degrees[t[r], a[r]] + rank] = k
+                degrees[t, a] += added
+
+                # Add new P permitted calls
+                if (P == CO):
+                    new &= ~unpackWords(contacts[t, a], n)
+                elif (P == LNS):
+                    new &= ~unpackWords(know[t, a], n)
+                if (permitted is not None):
+                    permitted[t, a] |= new
+                    weights[t, a] += new.sum(axis=1)
+                
+                # ANY - every new arc is a permitted call
+                if (P == ANY):
+                    weights[t, a] += added
+                    cumulative[t] += added[:, None] * (columns >= 
+                                                       a[:, None])
+                    totals[t] += added
+
+        # Update permitted calls (weights)
+        # CO - remove (i,j) and (j,i)
+        if (P == CO):
+            weights[active, i] -= 1
+            weights[active, j] -= permitted[active, j, i]
+            permitted[active, i, j] = False
+            permitted[active, j, i] = False
+        # LNS - remove calls (i,k) and (j,k) where k's secret is known
+        elif (P == LNS):
+            unknown = ~unpackWords(secrets, n)
+            for agent in (i, j):
+                permitted[active, agent] &= unknown
+                weights[active, agent] = permitted[active, agent].sum(axis=1)
+        # TOK and SPI - agents holding a token may call every neighbour
+        elif (P == TOK or P == SPI):
+            for agent in (i, j):
+                weights[active, agent] = (degrees[active, agent] *
+                                          token[active, agent])
+
+        # Update the prefix sums and totals of trials where the weight
+        # of i or j changed
+        for (agent, old) in zip((i, j), before if P != ANY else ()):
+            delta = weights[active, agent] - old
+            changed = delta != 0
+            if (changed.any()):
+                rows = active[changed]
+                cumulative[rows] += (delta[changed][:, None] * 
+                    (columns >= agent[changed][:, None]))
+                totals[rows] += delta[changed]
+
+        # Increment call counter
+        c += 1
+
+        # Record current time (shared between the trials of the batch)
+        timer = (time.perf_counter() - initTime)/K
+
+        # Timeout (time limit exceeded)
+        if (timeLimit is not None and timer > timeLimit):
+            for t in active:
+                results[t] = (c, timer, False, False, True)
+            break
+
+    return results
@@ -0,0 +1,143 @@
+'''This file contains a benchmark suite timing the protocol execution
+functions for each protocol on each topology over a range of numbers
+of agents, at a fixed seed so that every run performs the same calls.'''
+
+# Install modules
+import networkx as nx
+import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.rcParams["figure.dpi"] = 150
+import numpy as np
+from math import factorial
+import random
+import time
+import copy
+import pickle
+
+# ===============================================================
+#  Benchmark functions
+# ===============================================================
+
+# benchmark(top, name, n, rounds, trials, repeats, warmup, seed) -
+#          times the execution of one protocol on a set topology and
+#          number of agents
+# Parameters: top - network topology (complete, incomplete, dynamic)
+#             name - string, name of protocol (ANY, CO, LNS, TOK, SPI)
+#             n - number of agents
+#             rounds - boolean, times executeRounds (true) or
+#                      executeProtocol (false)
+#             trials - int, number of graphs executed per repeat
+#             repeats - int, number of timed repeats
+#             warmup - int, number of untimed repeats made first
+#             seed - int, master seed of the graphs and executions
+# Returns - dictionary, with the total length (calls, or rounds) and
+#           number of calls of the trials of a repeat, the best time of
+#           a repeat in seconds, and the resulting lengths, calls and 
+#           trials per second
+#
+# Graphs are generated and converted to GossipStates before timing, and
+# each repeat executes every trial from its initial state on the same
+# random stream, so only the executions are timed and every repeat
+# makes exactly the same calls. The best repeat is reported, as it is
+# the least disturbed by other load on the machine. In rounds the calls
+# are counted by an untimed repeat recording a CallTrace of each trial,
+# so the throughput of rounds and sequential calls can be compared.
+
+def benchmark(top, name, n, rounds = False, trials = 10, repeats = 3,
+              warmup = 1, seed = 0):
+    # Generate graphs of the trials
+    states = []
+    for trial in range(trials):
+        random.seed(trialSeed(seed, n, trial))
+        states.append(GossipState(generateGraph(n, top)))
+
+    P = protocolFunction(name)
+    execute = executeRounds if rounds else executeProtocol
+    
+    # executeTrial(trial, S, trace) - executes one trial from its
+    #                                 initial state on its own random stream
+    def executeTrial(trial, S, trace = None):
+        S.reset()
+        random.seed(trialSeed(seed, n, trial, PROTOCOLS.index(name) + 1))
+        return execute(S, P, False, None, None, None, trace)
+    
+    # Count the calls of the rounds of each trial (untimed)
+    calls = None
+    if (rounds):
+        calls = 0
+        for (trial, S) in enumerate(states):
+            trace = CallTrace()
+            executeTrial(trial, S, trace)
+            calls += len(trace)
+
+    # Time each repeat (after the warm-up repeats)
+    best, length = None, 0
+    for repeat in range(warmup + repeats):
+        elapsed, length = 0, 0
+        for (trial, S) in enumerate(states):
+            initTime = time.perf_counter()
+            outcome = executeTrial(trial, S)
+            elapsed += time.perf_counter() - initTime
+            length += outcome[0]
+        if (repeat >= warmup and (best is None or elapsed < best)):
+            best = elapsed
+    
+    # Sequential executions make one call per unit of length
+    if (calls is None):
+        calls = length
+
+    return {'length': length, 'calls': calls, 'time': best,
+            'lengthPerSecond': length/best, 'callsPerSecond': calls/best,
+            'trialsPerSecond': trials/best}
+
+
+# benchmarkSuite(nValues, tops, rounds, trials, repeats, warmup, seed) -
+#          times every protocol on every topology and number of agents,
+#          printing one line per benchmark
+# Parameters: nValues - tuple of numbers of agents
+#             tops - tuple of network topologies
+#             rounds - boolean, times executeRounds (true) or
+#                      executeProtocol (false)
+#             trials, repeats, warmup, seed - see benchmark
+# Returns - list of dictionaries, the results of benchmark together with
+#           the topology, protocol and number of agents
+
+def benchmarkSuite(nValues = (10, 20, 40),
+                   tops = ('complete', 'incomplete', 'dynamic'),
+                   rounds = False, trials = 10, repeats = 3, warmup = 1,
+                   seed = 0):
+    unit = 'rounds/s' if rounds else 'calls/s'
+    print('topology'.ljust(12)+'protocol'.ljust(10)+'n'.rjust(5)+
+          unit.rjust(14)+('calls/s'.rjust(14) if rounds else '')+
+          'trials/s'.rjust(12))
+
+    suite = []
+    for top in tops:
+        for name in PROTOCOLS:
+            for n in nValues:
+                result = benchmark(top, name, n, rounds, trials, repeats,
+                                   warmup, seed)
+                result.update({'top': top, 'protocol': name, 'n': n})
+                suite.append(result)
+                calls = ''
+                if (rounds):
+                    calls = str(round(result['callsPerSecond'])).rjust(14)
+                print(top.ljust(12)+name.ljust(10)+str(n).rjust(5)+
+                      str(round(result['lengthPerSecond'])).rjust(14)+
+                      calls+
+                      str(round(result['trialsPerSecond'], 2)).rjust(12))
+
+    return suite
+
+
+# ===============================================================
+#  Benchmarks
+# ===============================================================
+
+# The suite is only run when this file is run (not when it is imported)
+if __name__ == '__main__':
+    # Sequential calls
+    callBenchmarks = benchmarkSuite()
+    
+    # Calls made in rounds
+    roundBenchmarks = benchmarkSuite(rounds = True)
@@ -20,37 +20,38 @@ import pickle
 data = [[],[],[],[],[]]
 n = 50
 G = completeGraph(n)
+S = GossipState(G)
 trials = 50
 
 (srANY, srCO, srLNS, srTOK, srSPI) = (0,0,0,0,0)
 
 for trial in list(range(1,trials+1)):
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, ANY, False)
+    S.reset()
+    test = executeProtocol(S, ANY, False)
     if (test[2]):
         data[0].append(test[0])
         srANY += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, CO, False)
+    S.reset()
+    test = executeProtocol(S, CO, False)
     if (test[2]):
         data[1].append(test[0])
         srCO += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, LNS, False)
+    S.reset()
+    test = executeProtocol(S, LNS, False)
     if (test[2]):
         data[2].append(test[0])
         srLNS += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, TOK, False)
+    S.reset()
+    test = executeProtocol(S, TOK, False)
     if (test[2]):
         data[3].append(test[0])
         srTOK += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, SPI, False)
+    S.reset()
+    test = executeProtocol(S, SPI, False)
     if (test[2]):
         data[4].append(test[0])
         srSPI += 1
@@ -92,37 +93,38 @@ plt.show()
 data = [[],[],[],[],[]]
 n = 50
 G = incompleteGraph(n)
+S = GossipState(G)
 trials = 50
 
 (srANY, srCO, srLNS, srTOK, srSPI) = (0,0,0,0,0)
 
 for trial in list(range(1,trials+1)):
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, ANY, False)
+    S.reset()
+    test = executeProtocol(S, ANY, False)
     if (test[2]):
         data[0].append(test[0])
         srANY += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, CO, False)
+    S.reset()
+    test = executeProtocol(S, CO, False)
     if (test[2]):
         data[1].append(test[0])
         srCO += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, LNS, False)
+    S.reset()
+    test = executeProtocol(S, LNS, False)
     if (test[2]):
         data[2].append(test[0])
         srLNS += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, TOK, False)
+    S.reset()
+    test = executeProtocol(S, TOK, False)
     if (test[2]):
         data[3].append(test[0])
         srTOK += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, SPI, False)
+    S.reset()
+    test = executeProtocol(S, SPI, False)
     if (test[2]):
         data[4].append(test[0])
         srSPI += 1
@@ -164,37 +166,38 @@ plt.show()
 data = [[],[],[],[],[]]
 n = 50
 G = diGraph(n)
+S = GossipState(G)
 trials = 50
 
 (srANY, srCO, srLNS, srTOK, srSPI) = (0,0,0,0,0)
 
 for trial in list(range(1,trials+1)):
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, ANY, False)
+    S.reset()
+    test = executeProtocol(S, ANY, False)
     if (test[2]):
         data[0].append(test[0])
         srANY += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, CO, False)
+    S.reset()
+    test = executeProtocol(S, CO, False)
     if (test[2]):
         data[1].append(test[0])
         srCO += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, LNS, False)
+    S.reset()
+    test = executeProtocol(S, LNS, False)
     if (test[2]):
         data[2].append(test[0])
         srLNS += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, TOK, False)
+    S.reset()
+    test = executeProtocol(S, TOK, False)
     if (test[2]):
         data[3].append(test[0])
         srTOK += 1
     
-    H = copy.deepcopy(G)
-    test = executeProtocol(H, SPI, False)
+    S.reset()
+    test = executeProtocol(S, SPI, False)
     if (test[2]):
         data[4].append(test[0])
         srSPI += 1
@@ -0,0 +1,454 @@
+'''This file contains an exact solver for the success probability and
+expected execution length of a protocol on a small gossip graph,
+computed from the Markov chain of its protocol states (identifying
+states that are equal up to a relabelling of the agents) rather than
+estimated from simulated trials.'''
+
+# Install modules
+import networkx as nx
+import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.rcParams["figure.dpi"] = 150
+import numpy as np
+from math import factorial
+import itertools
+import random
+import time
+import copy
+import pickle
+
+# ===============================================================
+#  Protocol states
+# ===============================================================
+
+# A protocol state is a tuple (secrets, contacts, tokens, out), where
+# secrets and out are tuples of bitsets (the secrets known by, and
+# arcs from, each agent), contacts is a tuple of bitsets under CO (None
+# otherwise) and tokens is a bitset of token holders under TOK and SPI
+# (0 otherwise). In the dynamic case the arcs of an agent are its known
+# numbers other than its own, so they also record the numbers.
+
+# initialState(S, P) - protocol state of a GossipState
+# Parameters: S - GossipState of a gossip graph
+#             P - predefined protocol function
+# Returns: tuple, protocol state
+
+def initialState(S, P):
+    secrets = tuple(S.secrets)
+    contacts = tuple(S.contacts) if (P == CO) else None
+    tokens = 0
+    if (P == TOK or P == SPI):
+        tokens = toBitset(agent for agent in range(S.n) if S.token[agent])
+    out = tuple(S.outBits(agent) for agent in range(S.n))
+    return (secrets, contacts, tokens, out)
+
+
+# permittedCalls(state, P) - lists the P permitted calls of a state
+# Parameters: state - tuple, protocol state
+#             P - predefined protocol function
+# Returns: list of tuples (i,j), permitted calls
+
+def permittedCalls(state, P):
+    (secrets, contacts, tokens, out) = state
+    calls = []
+    for i in range(len(secrets)):
+        # Callees i may call
+        callees = out[i]
+        # CO - agents have not been in contact
+        if (P == CO):
+            callees &= ~contacts[i]
+        # LNS - i does not know the callee's secret
+        elif (P == LNS):
+            callees &= ~secrets[i]
+        # TOK and SPI - i has a token
+        elif ((P == TOK or P == SPI) and not (tokens >> i) & 1):
+            callees = 0
+        calls.extend((i, j) for j in bitsetMembers(callees))
+    return calls
+
+
+# nextState(state, P, i, j, dynamic) - protocol state after call (i,j)
+# Parameters: state - tuple, protocol state
+#             P - predefined protocol function
+#             i, j - int, indices of caller and callee agents
+#             dynamic - boolean, numbers are exchanged (dynamic case)
+# Returns: tuple, protocol state
+
+def nextState(state, P, i, j, dynamic):
+    (secrets, contacts, tokens, out) = state
+
+    # Exchange secrets
+    secrets = list(secrets)
+    secrets[i] = secrets[j] = secrets[i] | secrets[j]
+
+    # Add each agent to each others past contacts
+    if (P == CO):
+        contacts = list(contacts)
+        contacts[i] |= 1 << j
+        contacts[j] |= 1 << i
+        contacts = tuple(contacts)
+
+    # Exchange tokens
+    if (P == TOK):
+        tokens = (tokens & ~(1 << i)) | (1 << j)
+    elif (P == SPI):
+        tokens &= ~(1 << j)
+
+    # Exchange numbers (each agent gets an arc to every number it knows)
+    if (dynamic):
+        out = list(out)
+        numbers = out[i] | out[j] | (1 << i) | (1 << j)
+        out[i] = numbers & ~(1 << i)
+        out[j] = numbers & ~(1 << j)
+        out = tuple(out)
+
+    return (tuple(secrets), contacts, tokens, out)
+
+
+# ===============================================================
+#  Canonical states
+# ===============================================================
+
+# memberTable(n) - lists the agents of every bitset of n agents
+# Parameters: n - int, number of agents
+# Returns: list of tuples of ints, entry b lists the agents of bitset b
+
+def memberTable(n):
+    return [tuple(bitsetMembers(b)) for b in range(1 << n)]
+
+
+# relabelBitset(b, perm, members) - relabels the agents of a bitset
+# Parameters: b - int, bitset of agents
+#             perm - list of ints, new label of each agent
+#             members - list, member table (see memberTable)
+# Returns: int, bitset of the new labels of the agents of b
+
+def relabelBitset(b, perm, members):
+    r = 0
+    for k in members[b]:
+        r |= 1 << perm[k]
+    return r
+
+
+# relabelBitsets(bitsets, perm, members) - relabels the agents of a 
+#                                         tuple of bitsets (one per
+#                                         agent)
+# Parameters: bitsets - tuple of ints, bitset of each agent
+#             perm - list of ints, new label of each agent
+#             members - list, member table (see memberTable)
+# Returns: tuple of ints, bitset of each relabelled agent
+
+def relabelBitsets(bitsets, perm, members):
+    new = [0] * len(bitsets)
+    for (agent, b) in enumerate(bitsets):
+        new[perm[agent]] = relabelBitset(b, perm, members)
+    return tuple(new)
+
+
+# relabelState(state, perm, members) - relabels the agents of a protocol
+#                                      state
+# Parameters: state - tuple, protocol state
+#             perm - list of ints, new label of each agent
+#             members - list, member table (see memberTable)
+# Returns: tuple, relabelled protocol state
+
+def relabelState(state, perm, members):
+    (secrets, contacts, tokens, out) = state
+    if (contacts is not None):
+        contacts = relabelBitsets(contacts, perm, members)
+    return (relabelBitsets(secrets, perm, members), contacts,
+            relabelBitset(tokens, perm, members),
+            relabelBitsets(out, perm, members))
+
+
+# canonicalState(state, search, members) - representative of the 
+#                                          relabellings of a protocol
+#                                          state
+# Parameters: state - tuple, protocol state
+#             search - int, maximum number of relabellings compared
+#             members - list, member table (see memberTable)
+# Returns: tuple, protocol state
+#
+# Agents are coloured by repeatedly refining their colour with the
+# colours of the agents they know the secrets of, are known by, have
+# been in contact with and have arcs to and from (and whether they hold
+# a token), which no relabelling can change. The agents are then
+# relabelled in order of colour, trying every order of agents of equal
+# colour and keeping the smallest state, as long as there are at most
+# search such orders (otherwise agents of equal colour keep their
+# order). Two states with the same representative are always
+# relabellings of each other, so their chains are the same;
+# relabellings of a state almost always get the same representative.
+
+def canonicalState(state, search, members):
+    (secrets, contacts, tokens, out) = state
+    n = len(secrets)
+
+    # Agents related to each agent (in both directions)
+    relations = [secrets, out] + ([contacts] if contacts is not None
+                                  else [])
+    rows, cols = [], []
+    for bitsets in relations:
+        row = [members[bitsets[a] & ~(1 << a)] for a in range(n)]
+        col = [[] for _ in range(n)]
+        for a in range(n):
+            for k in row[a]:
+                col[k].append(a)
+        rows.append(row)
+        cols.append(col)
+
+    # Refine colours until the number of colours is stable
+    colour = [(tokens >> a) & 1 for a in range(n)]
+    count = len(set(colour))
+    while (True):
+        signature = [(colour[a],) + tuple(
+            tuple(sorted(colour[k] for k in related[a]))
+            for related in rows + cols) for a in range(n)]
+        ranks = {s: r for (r, s) in enumerate(sorted(set(signature)))}
+        colour = [ranks[s] for s in signature]
+        if (len(ranks) == count):
+            break
+        count = len(ranks)
+
+    # Agents of each colour, in order of colour
+    cells = [[] for _ in range(count)]
+    for a in range(n):
+        cells[colour[a]].append(a)
+
+    # Number of orders of agents of equal colour
+    orders = 1
+    for cell in cells:
+        orders *= factorial(len(cell))
+    if (orders > search):
+        choices = [cells]
+    else:
+        choices = itertools.product(*[itertools.permutations(cell)
+                                      for cell in cells])
+
+    # Smallest relabelled state
+    best = None
+    for choice in choices:
+        perm = [0] * n
+        label = 0
+        for cell in choice:
+            for a in cell:
+                perm[a] = label
+                label += 1
+        relabelled = relabelState(state, perm, members)
+        if (best is None or relabelled < best):
+            best = relabelled
+
+    return best
+
+
+# ===============================================================
+#  Exact solver
+# ===============================================================
+
+# strongComponents(successors) - strongly connected components of a
+#                                directed graph (Tarjan's algorithm)
+# Parameters: successors - list of lists of ints, successors of each
+#                          vertex
+# Returns: list of lists of ints, the components, each after every
+#          component reachable from it
+
+def strongComponents(successors):
+    N = len(successors)
+    index, low = [None] * N, [0] * N
+    onStack, stack, components = [False] * N, [], []
+    counter = 0
+
+    for root in range(N):
+        if (index[root] is not None):
+            continue
+        # Iterative depth first search (vertex, next successor position)
+        work = [(root, 0)]
+        while (len(work) != 0):
+            (v, k) = work.pop()
+            if (k == 0):
+                index[v] = low[v] = counter
+                counter += 1
+                stack.append(v)
+                onStack[v] = True
+            # Visit next unvisited successor, or finish v
+            descended = False
+            for pos in range(k, len(successors[v])):
+                w = successors[v][pos]
+                if (index[w] is None):
+                    work.append((v, pos + 1))
+                    work.append((w, 0))
+                    descended = True
+                    break
+                elif (onStack[w]):
+                    low[v] = min(low[v], index[w])
+            if (descended):
+                continue
+            # v is the root of a component
+            if (low[v] == index[v]):
+                component = []
+                while (True):
+                    w = stack.pop()
+                    onStack[w] = False
+                    component.append(w)
+                    if (w == v):
+                        break
+                components.append(component)
+            # Pass low link to parent
+            if (len(work) != 0):
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+
+    return components
+
+
+# exactProtocol(G, P, symmetry, search) - exact results of executing
+#                                         protocol P on graph G
+# Parameters: G - graph object, generated in "graph_generator.py", or
+#                 its GossipState (executions start from its state)
+#             P - predefined protocol function
+#             symmetry - boolean, if true states equal up to a
+#                        relabelling of the agents are identified
+#             search - int, maximum number of relabellings compared per
+#                      state (see canonicalState)
+# Returns - dictionary, with the probabilities 'sRate', 'fRate' and
+#           'tRate' that executeProtocol succeeds, fails or never
+#           terminates, the expected execution length of a successful
+#           execution 'avgLength' (None if it never succeeds) and the
+#           number of states of the chain 'states'
+#
+# Each state is a protocol state of sequential calls, which moves to the
+# state after each of its permitted calls with equal probability.
+# States where all agents are experts are successes, and states with no
+# permitted calls, or where P is stuck (see stuck in "protocols.py"),
+# are failures. The reachable states are explored once (memoising the
+# representative of each state), and the success probability p and
+# E[length; success] m of each state solved one strongly connected
+# component at a time, successors first, from
+#     p(s) = sum_t P(s,t) p(t),  m(s) = p(s) + sum_t P(s,t) m(t).
+# Components with no way out never terminate. The number of states
+# grows quickly with n: on a complete graph at n = 6, ANY has about
+# 2000 states (seconds) and TOK about 40000 (half a minute), and ANY
+# has about 70000 at n = 7, so the solver is meant for small or sparse
+# graphs, where it replaces simulation noise with exact values.
+
+def exactProtocol(G, P, symmetry = True, search = 720):
+    # Fetch compact state of G
+    S = G if isinstance(G, GossipState) else GossipState(G)
+    n, full, dynamic = S.n, S.full, S.dynamic
+
+    # Representatives of states (memoised)
+    memo = {}
+    members = memberTable(n) if (symmetry) else None
+    def canonical(state):
+        if (not symmetry):
+            return state
+        key = memo.get(state)
+        if (key is None):
+            key = memo[state] = canonicalState(state, search, members)
+        return key
+
+    # Explore reachable states (index of each state, and its kind: 0
+    # transient, 1 success, 2 failure)
+    initial = canonical(initialState(S, P))
+    states, index = [initial], {initial: 0}
+    kind, transitions = [], []
+
+    k = 0
+    while (k < len(states)):
+        state = states[k]
+        k += 1
+        secrets = state[0]
+
+        # Success
+        if (all(b == full for b in secrets)):
+            kind.append(1)
+            transitions.append({})
+            continue
+
+        # Failure (no permitted calls, or P stuck)
+        calls = permittedCalls(state, P)
+        if (len(calls) == 0 or ((P == CO or P == SPI) and not any(
+                secrets[i] != secrets[j] or (dynamic and
+                state[3][i] | (1 << i) != state[3][j] | (1 << j))
+                for (i, j) in calls))):
+            kind.append(2)
+            transitions.append({})
+            continue
+
+        # Each permitted call is made with equal probability
+        kind.append(0)
+        probabilities = {}
+        for (i, j) in calls:
+            nxt = canonical(nextState(state, P, i, j, dynamic))
+            t = index.get(nxt)
+            if (t is None):
+                t = index[nxt] = len(states)
+                states.append(nxt)
+            probabilities[t] = probabilities.get(t, 0) + 1/len(calls)
+        transitions.append(probabilities)
+
+    # Success probability, never terminating probability and
+    # E[length; success] of each state
+    N = len(states)
+    p, q, m = np.zeros(N), np.zeros(N), np.zeros(N)
+    for s in range(N):
+        if (kind[s] == 1):
+            p[s] = 1
+
+    # Solve one component at a time, successors first
+    successors = [list(transitions[s]) for s in range(N)]
+    for component in strongComponents(successors):
+        if (kind[component[0]] != 0):
+            continue
+        local = {s: r for (r, s) in enumerate(component)}
+        size = len(component)
+
+        # Transitions within the component, and contributions of
+        # (solved) states outside it
+        A = np.eye(size)
+        bp, bm = np.zeros(size), np.zeros(size)
+        exits = False
+        for (r, s) in enumerate(component):
+            for (t, pr) in transitions[s].items():
+                if (t in local):
+                    A[r, local[t]] -= pr
+                else:
+                    exits = True
+                    bp[r] += pr * p[t]
+                    bm[r] += pr * m[t]
+
+        # A component with no way out never terminates
+        if (not exits):
+            q[component] = 1
+            continue
+
+        bq = np.zeros(size)
+        for (r, s) in enumerate(component):
+            for (t, pr) in transitions[s].items():
+                if (t not in local):
+                    bq[r] += pr * q[t]
+
+        # Solve for p and q, then m (as m(s) - sum P(s,t) m(t) =
+        # p(s) + contributions outside the component)
+        x = np.linalg.solve(A, np.column_stack([bp, bq]))
+        p[component], q[component] = x[:, 0], x[:, 1]
+        m[component] = np.linalg.solve(A, bm + x[:, 0])
+
+    success, timeout = float(p[0]), float(q[0])
+    return {'sRate': success, 'fRate': max(0.0, 1 - success - timeout),
+            'tRate': timeout,
+            'avgLength': float(m[0]/p[0]) if (p[0] > 0) else None,
+            'states': N}
+
+
+# exactProtocols(G, symmetry, search) - exact results of the five
+#                                       protocols on graph G
+# Parameters: G - graph object or GossipState (see exactProtocol)
+#             symmetry, search - see exactProtocol
+# Returns - dictionary {protocol: results of exactProtocol}
+
+def exactProtocols(G, symmetry = True, search = 720):
+    protocols = {'ANY': ANY, 'CO': CO, 'LNS': LNS, 'TOK': TOK,
+                 'SPI': SPI}
+    return {name: exactProtocol(G, P, symmetry, search)
+            for (name, P) in protocols.items()}
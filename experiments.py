@@ -12,322 +12,529 @@ import random
 import time
 import copy
 import pickle
+import json
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # ===============================================================
-#  Test protocols function
+#  Trial tools
 # ===============================================================
 
-# testProtocols(n, top, trials, rounds) - executes the five 
-#                protocols on a set topology and number of agents
+# trialSeed(seed, *keys) - derives the seed of an independent random
+#                          stream from a master seed
+# Parameters: seed - int, master seed
+#             keys - ints identifying the stream (e.g. n, trial and
+#                    protocol number)
+# Returns - int, seed of the stream
+
+def trialSeed(seed, *keys):
+    return int(np.random.SeedSequence([seed, *keys]).generate_state(1)[0])
+
+
+# generateGraph(n, top) - generates a gossip graph of set topology
+# Parameters: n - number of agents
+#             top - network topology (complete, incomplete, dynamic)
+# Returns - graph object with n nodes
+
+def generateGraph(n, top):
+    if (top == 'complete'):
+        return completeGraph(n)
+    elif (top == 'incomplete'):
+        return incompleteGraph(n)
+    elif (top == 'dynamic'):
+        return diGraph(n)
+
+
+# protocolFunction(name) - fetches a protocol function by name
+# Parameters: name - string, name of protocol (ANY, CO, LNS, TOK, SPI)
+# Returns - predefined protocol function
+
+def protocolFunction(name):
+    return {'ANY': ANY, 'CO': CO, 'LNS': LNS, 'TOK': TOK, 'SPI': SPI}[name]
+
+
+# trialGraph(n, top, trial, seed) - generates the graph of one trial 
+#          from its random stream (the same graph is generated for 
+#          every protocol of a trial)
+# Parameters: n - number of agents
+#             top - network topology (complete, incomplete, dynamic)
+#             trial - int, trial number
+#             seed - int, master seed
+# Returns - graph object with n nodes
+
+def trialGraph(n, top, trial, seed):
+    random.seed(trialSeed(seed, n, trial))
+    return generateGraph(n, top)
+
+
+# runTrial(n, top, rounds, names, trial, seed, budget, timeLimit, 
+#          traceDir) - executes protocols on the graph of one trial, 
+#                      using random streams derived from the master seed
 # Parameters: n - number of agents
 #             top - network topology (complete, incomplete, dynamic)
-#             trials - int, number of trials
 #             rounds - boolean, dictates if calls are made in 
 #                      rounds (true) or not (false)
-# Returns - dictionary, contains all results for set n
+#             names - list of strings, names of protocols (ANY, CO, 
+#                     LNS, TOK, SPI)
+#             trial - int, trial number
+#             seed - int, master seed
+#             budget - int, maximum number of calls (or rounds) of each
+#                      execution (None uses defaultBudget(n), or 
+#                      defaultRoundBudget(n) in rounds)
+#             timeLimit - float, optional wall-clock limit in seconds
+#             traceDir - string, directory the call trace of each 
+#                        protocol is saved to if it is unsuccessful, as
+#                        "<top>-<calls|rounds>-<n>-<name>-<trial>-<seed>
+#                        .npz" (None saves no trace)
+# Returns - list of tuples (c, timer, success, failure, timeout) as 
+#           returned by executeProtocol (or executeRounds), one for each
+#           protocol in names
+#
+# The graph and its gossip state are built once and reset between the
+# protocols. Each protocol runs on its own random stream, so outcomes do
+# not depend on which protocols of the trial are executed together. A 
+# saved trace is replayed on trialGraph(n, top, trial, seed) with 
+# replayTrace.
 
-def testProtocols(n, top, trials, rounds = False):
-    # Case where calls are made sequentially
-    if (not rounds):
-        # Intialise results dictionary
-        results = {'ANY':{'execLengths':[], 'execTimes':[], 'avgTime': 0,
-                          'avgLength': 0, 'sNumber': 0, 'fNumber': 0,
-                          'tNumber': 0}, 
-                   'CO':{'execLengths':[], 'execTimes':[], 'avgTime': 0,
-                         'avgLength': 0, 'sNumber': 0, 'fNumber': 0,
-                         'tNumber': 0},
-                   'LNS':{'execLengths':[], 'execTimes':[], 'avgTime': 0,
-                          'avgLength': 0, 'sNumber': 0, 'fNumber': 0,
-                          'tNumber': 0}, 
-                   'TOK':{'execLengths':[], 'execTimes':[], 'avgTime': 0,
-                          'avgLength': 0, 'sNumber': 0, 'fNumber': 0,
-                          'tNumber': 0},
-                   'SPI':{'execLengths':[], 'execTimes':[], 'avgTime': 0,
-                          'avgLength': 0, 'sNumber': 0, 'fNumber': 0,
-                          'tNumber': 0}}
+def runTrial(n, top, rounds, names, trial, seed, budget = None, 
+             timeLimit = None, traceDir = None):
+    # Generate graph and gossip state of trial
+    S = GossipState(trialGraph(n, top, trial, seed))
+    
+    outcomes = []
+    for name in names:
+        # Trace of the calls made
+        trace = None if traceDir is None else CallTrace()
         
-        # For set number of trials
-        for _ in range(trials):
-            # Generate graph
-            if (top == 'complete'):
-                G = completeGraph(n)
-            elif (top == 'incomplete'):
-                G = incompleteGraph(n)
-            elif (top == 'dynamic'):
-                G = diGraph(n)
-            
-            # Create copy of graph
-            H = copy.deepcopy(G)
-            
-            # Run each protocol on H and record results
-            # (number of successes, failures and timeouts)
-            #ANY
-            (c, timer, success, failure, timeout) = executeProtocol(H, ANY)
-            if (success):
-                results['ANY']['execLengths'].append(c)
-                results['ANY']['execTimes'].append(timer)
-                results['ANY']['sNumber'] += 1
-            elif (failure):
-                results['ANY']['fNumber'] += 1
-            elif (timeout):
-                results['ANY']['tNumber'] += 1
-            # CO
-            H = copy.deepcopy(G)
-            (c, timer, success, failure, timeout) = executeProtocol(H, CO)
-            if (success):
-                results['CO']['execLengths'].append(c)
-                results['CO']['execTimes'].append(timer)
-                results['CO']['sNumber'] += 1
-            elif (failure):
-                results['CO']['fNumber'] += 1
-            elif (timeout):
-                results['CO']['tNumber'] += 1
-            # LNS
-            H = copy.deepcopy(G)
-            (c, timer, success, failure, timeout) = executeProtocol(H, LNS)
-            if (success):
-                results['LNS']['execLengths'].append(c)
-                results['LNS']['execTimes'].append(timer)
-                results['LNS']['sNumber'] += 1
-            elif (failure):
-                results['LNS']['fNumber'] += 1
-            elif (timeout):
-                results['LNS']['tNumber'] += 1
-            # TOK
-            H = copy.deepcopy(G)
-            (c, timer, success, failure, timeout) = executeProtocol(H, TOK)
-            if (success):
-                results['TOK']['execLengths'].append(c)
-                results['TOK']['execTimes'].append(timer)
-                results['TOK']['sNumber'] += 1
-            elif (failure):
-                results['TOK']['fNumber'] += 1
-            elif (timeout):
-                results['TOK']['tNumber'] += 1
-            # SPI
-            H = copy.deepcopy(G)
-            (c, timer, success, failure, timeout) = executeProtocol(H, SPI)
-            if (success):
-                results['SPI']['execLengths'].append(c)
-                results['SPI']['execTimes'].append(timer)
-                results['SPI']['sNumber'] += 1
-            elif (failure):
-                results['SPI']['fNumber'] += 1
-            elif (timeout):
-                results['SPI']['tNumber'] += 1
-                
-        # Calculate averages and success rates
-        # ANY
-        if (len(results['ANY']['execLengths']) > 0):
-            results['ANY']['avgLength'] = sum(
-                results['ANY']['execLengths'])/results['ANY']['sNumber']
-            results['ANY']['avgTime'] = sum(
-                results['ANY']['execTimes'])/results['ANY']['sNumber']
-        else:
-            results['ANY']['avgLengths'] = None
-            results['ANY']['avgTime'] = None
-        results['ANY']['sRate'] = results['ANY']['sNumber']/trials
-        results['ANY']['fRate'] = results['ANY']['fNumber']/trials
-        results['ANY']['tRate'] = results['ANY']['tNumber']/trials
-        # CO
-        if (len(results['CO']['execLengths']) > 0):
-            results['CO']['avgLength'] = sum(
-                results['CO']['execLengths'])/results['CO']['sNumber']
-            results['CO']['avgTime'] = sum(
-                results['CO']['execTimes'])/results['CO']['sNumber']
-        else:
-            results['ANY']['avgLengths'] = None
-            results['ANY']['avgTime'] = None
-        results['CO']['sRate'] = results['CO']['sNumber']/trials
-        results['CO']['fRate'] = results['CO']['fNumber']/trials
-        results['CO']['tRate'] = results['CO']['tNumber']/trials
-        # LNS
-        if (len(results['LNS']['execLengths']) > 0):
-            results['LNS']['avgLength'] = sum(
-                results['LNS']['execLengths'])/results['LNS']['sNumber']
-            results['LNS']['avgTime'] = sum(
-                results['LNS']['execTimes'])/results['LNS']['sNumber']
-        else:
-            results['LNS']['avgLengths'] = None
-            results['LNS']['avgTime'] = None
-        results['LNS']['sRate'] = results['LNS']['sNumber']/trials
-        results['LNS']['fRate'] = results['LNS']['fNumber']/trials
-        results['LNS']['tRate'] = results['LNS']['tNumber']/trials
-        # TOK
-        if (len(results['TOK']['execLengths']) > 0):
-            results['TOK']['avgLength'] = sum(
-                results['TOK']['execLengths'])/results['TOK']['sNumber']
-            results['TOK']['avgTime'] = sum(
-                results['TOK']['execTimes'])/results['TOK']['sNumber']
+        # Execute protocol on its own random stream
+        S.reset()
+        random.seed(trialSeed(seed, n, trial, PROTOCOLS.index(name) + 1))
+        if (rounds):
+            outcome = executeRounds(S, protocolFunction(name), False, 
+                                    budget, timeLimit, None, trace)
         else:
-            results['TOK']['avgLengths'] = None
-            results['TOK']['avgTime'] = None
-        results['TOK']['sRate'] = results['TOK']['sNumber']/trials
-        results['TOK']['fRate'] = results['TOK']['fNumber']/trials
-        results['TOK']['tRate'] = results['TOK']['tNumber']/trials
-        # SPI
-        if (len(results['SPI']['execLengths']) > 0):
-            results['SPI']['avgLength'] = sum(
-                results['SPI']['execLengths'])/results['SPI']['sNumber']
-            results['SPI']['avgTime'] = sum(
-                results['SPI']['execTimes'])/results['SPI']['sNumber']
-        else:
-            results['SPI']['avgLengths'] = None
-            results['SPI']['avgTime'] = None
-        results['SPI']['sRate'] = results['SPI']['sNumber']/trials
-        results['SPI']['fRate'] = results['SPI']['fNumber']/trials
-        results['SPI']['tRate'] = results['SPI']['tNumber']/trials
-        
-    # Case where calls are made in rounds
-    if (rounds):
-        # Intialise results dictionary
-        results = {'ANY':{'rounds':[], 'avgRounds': 0,
-                          'times':[], 'avgTime': 0, 'sNumber': 0,
-                          'fNumber': 0, 'tNumber': 0}, 
-                   'CO':{'rounds':[], 'avgRounds': 0,
-                         'times':[], 'avgTime': 0, 'sNumber': 0,
-                         'fNumber': 0, 'tNumber': 0},
-                   'LNS':{'rounds':[], 'avgRounds': 0,
-                          'times':[], 'avgTime': 0, 'sNumber': 0,
-                          'fNumber': 0, 'tNumber': 0}, 
-                   'TOK':{'rounds':[], 'avgRounds': 0,
-                          'times':[], 'avgTime': 0, 'sNumber': 0,
-                          'fNumber': 0, 'tNumber': 0},
-                   'SPI':{'rounds':[], 'avgRounds': 0,
-                          'times':[], 'avgTime': 0, 'sNumber': 0,
-                          'fNumber': 0, 'tNumber': 0}}
+            outcome = executeProtocol(S, protocolFunction(name), False, 
+                                      budget, timeLimit, None, trace)
         
-        # For set number of trials
+        # Save the trace of an unsuccessful execution
+        if (trace is not None and not outcome[2]):
+            mode = 'rounds' if rounds else 'calls'
+            trace.save(os.path.join(traceDir, '-'.join(
+                [top, mode, str(n), name, str(trial), str(seed)]) + 
+                '.npz'))
+        outcomes.append(outcome)
+    
+    return outcomes
+
+
+# readRecords(path, top, rounds, n) - reads the trial records of a set
+#                                     topology and number of agents 
+#                                     from a results file
+# Parameters: path - string, path of the results file (one JSON record
+#                    per line, see writeRecord)
+#             top - network topology (complete, incomplete, dynamic)
+#             rounds - boolean, calls made in rounds (true) or not
+#             n - number of agents
+# Returns - list of dictionaries, the matching records
+#
+# A line cut short by an interrupted sweep is skipped, and terminated 
+# so that new records start on a line of their own.
+
+def readRecords(path, top, rounds, n):
+    records = []
+    if (not os.path.exists(path)):
+        return records
+    
+    with open(path) as file:
+        text = file.read()
+    for line in text.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if (record['top'] == top and record['rounds'] == rounds
+            and record['n'] == n):
+            records.append(record)
+    
+    # Terminate a cut short last line
+    if (text and not text.endswith('\n')):
+        with open(path, 'a') as file:
+            file.write('\n')
+    
+    return records
+
+
+# writeRecord(path, top, rounds, n, name, trial, seed, outcome) - 
+#          appends the record of one trial to a results file
+# Parameters: path - string, path of the results file
+#             top, rounds, n - topology, rounds and number of agents
+#             name - string, name of protocol (ANY, CO, LNS, TOK, SPI)
+#             trial - int, trial number
+#             seed - int, master seed of the trial (None if unseeded)
+#             outcome - tuple (c, timer, success, failure, timeout) as
+#                       returned by executeProtocol (or executeRounds)
+# Returns - nothing, the record is written as one line of JSON
+
+def writeRecord(path, top, rounds, n, name, trial, seed, outcome):
+    (c, timer, success, failure, timeout) = outcome
+    record = {'top': top, 'rounds': rounds, 'n': n, 'protocol': name,
+              'trial': trial, 'seed': seed, 'length': c, 'time': timer,
+              'success': success, 'failure': failure, 'timeout': timeout}
+    with open(path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+# ===============================================================
+#  Confidence intervals
+# ===============================================================
+
+# lengthInterval(lengths, z) - confidence interval of a mean length
+# Parameters: lengths - list of numbers, lengths of successful trials
+#             z - float, normal quantile of the confidence level
+#                 (1.96 for 95%)
+# Returns - tuple (low, high), None if there are fewer than 2 lengths
+
+def lengthInterval(lengths, z = 1.96):
+    if (len(lengths) < 2):
+        return None
+    mean = np.mean(lengths)
+    half = z * np.std(lengths, ddof=1)/np.sqrt(len(lengths))
+    return (float(mean - half), float(mean + half))
+
+
+# rateInterval(k, trials, z) - Wilson confidence interval of a rate
+# Parameters: k - int, number of trials with the outcome
+#             trials - int, number of trials
+#             z - float, normal quantile of the confidence level
+# Returns - tuple (low, high)
+#
+# Unlike the normal interval, the Wilson interval does not collapse to
+# a point when no trial (or every trial) has the outcome.
+
+def rateInterval(k, trials, z = 1.96):
+    p = k/trials
+    centre = (p + z**2/(2*trials))/(1 + z**2/trials)
+    half = (z * np.sqrt(p*(1 - p)/trials + z**2/(4*trials**2)) /
+            (1 + z**2/trials))
+    return (float(max(0.0, centre - half)), float(min(1.0, centre + half)))
+
+
+# intervalWidth(outcomes, statistic, z) - width of the confidence
+#          interval of a protocol's mean length or success rate
+# Parameters: outcomes - list of tuples (c, timer, success, failure,
+#                        timeout), one per trial
+#             statistic - string, 'length' for the mean length of
+#                         successful trials (width relative to the mean)
+#                         or 'sRate' for the success rate
+#             z - float, normal quantile of the confidence level
+# Returns - float, width of the interval
+#
+# The variance of the lengths is unreliable with fewer than 10
+# successes, so the width of the success rate interval is returned
+# instead: a protocol that rarely succeeds is sampled until its success
+# rate is known (or it has enough successes).
+
+def intervalWidth(outcomes, statistic = 'length', z = 1.96):
+    lengths = [outcome[0] for outcome in outcomes if outcome[2]]
+    if (statistic == 'length' and len(lengths) >= 10):
+        interval = lengthInterval(lengths, z)
+        return (interval[1] - interval[0])/np.mean(lengths)
+    (low, high) = rateInterval(len(lengths), len(outcomes), z)
+    return high - low
+
+
+# moreTrials(outcomes, statistic, width) - estimates the number of
+#          further trials needed to reach a target interval width
+# Parameters: outcomes - list of tuples, one per trial (see
+#                        intervalWidth)
+#             statistic - string, 'length' or 'sRate' (see
+#                         intervalWidth)
+#             width - float, target width of the 95% interval
+# Returns - int, number of further trials (0 if the target is reached)
+#
+# The width shrinks with the square root of the number of trials, so
+# the estimate scales the trials by the squared ratio of the widths. It
+# is capped at doubling the trials, as early estimates of the variance
+# are poor.
+
+def moreTrials(outcomes, statistic, width):
+    current = intervalWidth(outcomes, statistic)
+    if (current <= width):
+        return 0
+    trials = len(outcomes)
+    needed = int(np.ceil(trials * (current/width)**2))
+    return max(1, min(needed - trials, trials))
+
+
+# ===============================================================
+#  Test protocols function
+# ===============================================================
+
+# Names of the five protocols, in the order they are tested
+PROTOCOLS = ['ANY', 'CO', 'LNS', 'TOK', 'SPI']
+
+# testProtocols(n, top, trials, rounds, batch, workers, seed, budget,
+#               timeLimit, path, traceDir, width, statistic, maxTrials,
+#               timeBudget) - executes the five protocols on a set
+#                             topology and number of agents
+# Parameters: n - number of agents
+#             top - network topology (complete, incomplete, dynamic)
+#             trials - int, number of trials
+#             rounds - boolean, dictates if calls are made in 
+#                      rounds (true) or not (false)
+#             batch - boolean, dictates if the trials of each protocol
+#                     are executed together in lockstep using
+#                     executeBatch (sequential calls only)
+#             workers - int, number of processes the trials are 
+#                       executed on (None executes them in this process)
+#             seed - int, master seed from which the random stream of
+#                    each (trial, protocol) pair (or with batch, of the
+#                    graphs and of each protocol) is derived, so results
+#                    do not depend on the number of workers or on which
+#                    trials were already recorded (None uses the global
+#                    random state)
+#             budget - int, maximum number of calls (or rounds) of each
+#                      execution before it times out (None uses 
+#                      defaultBudget(n), or defaultRoundBudget(n) in
+#                      rounds)
+#             timeLimit - float, optional wall-clock limit in seconds of
+#                         each execution (None for no limit)
+#             path - string, path of a results file each trial is 
+#                    appended to as soon as it completes (None keeps
+#                    results in memory only)
+#             traceDir - string, directory the call traces of
+#                        unsuccessful trials are saved to (see runTrial,
+#                        not with batch)
+#             width - float, target width of the 95% confidence interval
+#                     of each protocol (None runs exactly trials trials)
+#             statistic - string, interval the width applies to: 'length'
+#                         for the mean length, relative to the mean, or
+#                         'sRate' for the success rate (see
+#                         intervalWidth)
+#             maxTrials - int, maximum number of trials of each protocol
+#                         with a width (None for 100 * trials)
+#             timeBudget - float, optional number of seconds of
+#                          execution time after which no further trials
+#                          of a protocol are run (None for no budget)
+# Returns - dictionary, contains all results for set n, including the
+#           number of trials of each protocol and the confidence
+#           intervals of its mean length and success rate
+#
+# Workers are forked processes, so this file must be run (not only
+# imported) on a platform supporting fork. Times depend on the machine
+# and load, everything else (including timeouts, unless a time limit is
+# given) is reproducible given seed.
+#
+# With a results file, trials already recorded in it (for the same 
+# topology, rounds, n and seed) are not executed again, so an 
+# interrupted sweep is resumed by calling the function again. Without a
+# seed, the seed recorded in the file is reused (or a new one drawn), 
+# so a resumed sweep gives the same results as an uninterrupted one.
+#
+# With a width, each protocol is first run on trials trials, and then on
+# further trials (numbered on from trials, in chunks estimated by
+# moreTrials) until its interval is narrower than width, maxTrials is
+# reached or its executions have taken timeBudget seconds. Trials are
+# spent where the variance is, e.g. on the failure rates of the
+# restrictive protocols rather than on ANY. The number of trials is
+# reproducible given seed, unless a time budget (or limit) is given.
+
+def testProtocols(n, top, trials, rounds = False, batch = False,
+                  workers = None, seed = None, budget = None,
+                  timeLimit = None, path = None, traceDir = None,
+                  width = None, statistic = 'length', maxTrials = None,
+                  timeBudget = None):
+    # Batches only support sequential calls in this process
+    if (batch and (rounds or workers is not None)):
+        raise ValueError("batch execution requires sequential calls "
+                         "in a single process")
+    if (batch and traceDir is not None):
+        raise ValueError("batch execution does not record call traces")
+    if (batch and width is not None):
+        raise ValueError("batch execution runs a fixed number of trials")
+    if (statistic not in ['length', 'sRate']):
+        raise ValueError("statistic must be 'length' or 'sRate'")
+
+    # Keys of results for calls made sequentially or in rounds
+    if (not rounds):
+        lengths, times, avgLength = 'execLengths', 'execTimes', 'avgLength'
+    else:
+        lengths, times, avgLength = 'rounds', 'times', 'avgRounds'
+    
+    # Intialise results dictionary
+    results = {}
+    for name in PROTOCOLS:
+        results[name] = {lengths: [], times: [], 'avgTime': 0, 
+                         avgLength: 0, 'sNumber': 0, 'fNumber': 0, 
+                         'tNumber': 0}
+    
+    # Outcomes of each protocol (one tuple per trial), and number of
+    # trials of each protocol
+    outcomes = {name: [] for name in PROTOCOLS}
+    counts = {name: trials for name in PROTOCOLS}
+    
+    # Outcomes of (protocol, trial) pairs already in the results file
+    recorded = {}
+    if (path is not None):
+        records = readRecords(path, top, rounds, n)
+        if (seed is None):
+            if (len(records) > 0):
+                seed = records[0]['seed']
+            else:
+                seed = random.getrandbits(64)
+        for record in records:
+            if (record['seed'] == seed):
+                recorded[(record['protocol'], record['trial'])] = (
+                    record['length'], record['time'], record['success'],
+                    record['failure'], record['timeout'])
+    
+    # Execute the trials of each protocol in lockstep (vectorised)
+    if (batch):
+        if (seed is not None):
+            random.seed(trialSeed(seed, n))
+        graphs = [generateGraph(n, top) for _ in range(trials)]
+        for name in PROTOCOLS:
+            # Trials not yet recorded
+            missing = [trial for trial in range(trials) 
+                       if (name, trial) not in recorded]
+            if (len(missing) == 0):
+                continue
+            # Each protocol runs on its own random stream, so skipping 
+            # recorded protocols does not change the others
+            if (seed is not None):
+                random.seed(trialSeed(seed, n, PROTOCOLS.index(name) + 1))
+            done = executeBatch(graphs, protocolFunction(name), budget,
+                                timeLimit)
+            for trial in missing:
+                recorded[(name, trial)] = done[trial]
+                if (path is not None):
+                    writeRecord(path, top, rounds, n, name, trial, seed,
+                                done[trial])
+    
+    # Execute each (trial, protocol) pair on its own random stream
+    elif (workers is not None or seed is not None or
+          traceDir is not None or width is not None):
+        if (seed is None):
+            seed = random.getrandbits(64)
+
+        # executePairs(pairs) - executes (protocol, trial) pairs not yet
+        #                       recorded, one item per trial
+        def executePairs(pairs):
+            names = {}
+            for (name, trial) in pairs:
+                if ((name, trial) not in recorded):
+                    names.setdefault(trial, []).append(name)
+            items = [(n, top, rounds, names[trial], trial, seed, budget,
+                      timeLimit, traceDir) for trial in sorted(names)]
+
+            # In this process, recording each outcome as soon as it
+            # completes
+            if (workers is None or workers == 1 or len(items) == 0):
+                for item in items:
+                    for (name, outcome) in zip(item[3], runTrial(*item)):
+                        recorded[(name, item[4])] = outcome
+                        if (path is not None):
+                            writeRecord(path, top, rounds, n, name,
+                                        item[4], seed, outcome)
+            # On a pool of forked processes, recording the outcomes of
+            # each trial as soon as it completes (in any order, so an
+            # interrupted run keeps every finished trial)
+            else:
+                context = multiprocessing.get_context('fork')
+                with ProcessPoolExecutor(workers,
+                                         mp_context=context) as pool:
+                    futures = {pool.submit(runTrial, *item): item
+                               for item in items}
+                    for future in as_completed(futures):
+                        item = futures[future]
+                        for (name, outcome) in zip(item[3], 
+                                                   future.result()):
+                            recorded[(name, item[4])] = outcome
+                            if (path is not None):
+                                writeRecord(path, top, rounds, n, name,
+                                            item[4], seed, outcome)
+
+        executePairs([(name, trial) for trial in range(trials)
+                      for name in PROTOCOLS])
+
+        # Run further trials of each protocol until its interval is
+        # narrow enough (or its trials or time run out)
+        if (width is not None):
+            if (maxTrials is None):
+                maxTrials = 100 * trials
+            active = list(PROTOCOLS)
+            while (len(active) > 0):
+                pairs = []
+                for name in list(active):
+                    done = [recorded[(name, trial)]
+                            for trial in range(counts[name])]
+                    more = min(moreTrials(done, statistic, width),
+                               maxTrials - counts[name])
+                    spent = sum(outcome[1] for outcome in done)
+                    if (more <= 0 or (timeBudget is not None and
+                                      spent >= timeBudget)):
+                        active.remove(name)
+                        continue
+                    pairs.extend((name, trial) for trial in
+                                 range(counts[name], counts[name] + more))
+                    counts[name] += more
+                executePairs(pairs)
+
+    # Execute the trials one at a time on the global random state
+    else:
         for _ in range(trials):
             # Generate graph
-            if (top == 'complete'):
-                G = completeGraph(n)
-            elif (top == 'incomplete'):
-                G = incompleteGraph(n)
-            elif (top == 'dynamic'):
-                G = diGraph(n)
+            G = generateGraph(n, top)
             
-            # Create copy of graph
-            H = copy.deepcopy(G)
-            
-            # Run each protocol on H and record results
-            # (number of successes, failures and timeouts)
-            #ANY
-            (r, timer, success, failure, timeout) = executeRounds(H, ANY)
-            if (success):
-                results['ANY']['rounds'].append(r)
-                results['ANY']['times'].append(timer)
-                results['ANY']['sNumber'] += 1
-            elif (failure):
-                results['ANY']['fNumber'] += 1
-            elif (timeout):
-                results['ANY']['tNumber'] += 1
-            # CO
-            H = copy.deepcopy(G)
-            (r, timer, success, failure, timeout) = executeRounds(H, CO)
-            if (success):
-                results['CO']['rounds'].append(r)
-                results['CO']['times'].append(timer)
-                results['CO']['sNumber'] += 1
-            elif (failure):
-                results['CO']['fNumber'] += 1
-            elif (timeout):
-                results['CO']['tNumber'] += 1
-            # LNS
-            H = copy.deepcopy(G)
-            (r, timer, success, failure, timeout) = executeRounds(H, LNS)
-            if (success):
-                results['LNS']['rounds'].append(r)
-                results['LNS']['times'].append(timer)
-                results['LNS']['sNumber'] += 1
-            elif (failure):
-                results['LNS']['fNumber'] += 1
-            elif (timeout):
-                results['LNS']['tNumber'] += 1
-            # TOK
-            H = copy.deepcopy(G)
-            (r, timer, success, failure, timeout) = executeRounds(H, TOK)
-            if (success):
-                results['TOK']['rounds'].append(r)
-                results['TOK']['times'].append(timer)
-                results['TOK']['sNumber'] += 1
-            elif (failure):
-                results['TOK']['fNumber'] += 1
-            elif (timeout):
-                results['TOK']['tNumber'] += 1
-            # SPI
-            H = copy.deepcopy(G)
-            (r, timer, success, failure, timeout) = executeRounds(H, SPI)
+            # Run each protocol on the initial state of G
+            S = GossipState(G)
+            for name in PROTOCOLS:
+                S.reset()
+                if (rounds):
+                    outcome = executeRounds(S, protocolFunction(name),
+                                            False, budget, timeLimit)
+                else:
+                    outcome = executeProtocol(S, protocolFunction(name),
+                                              False, budget, timeLimit)
+                outcomes[name].append(outcome)
+    
+    # Outcomes of each protocol in trial order
+    if (batch or seed is not None):
+        for name in PROTOCOLS:
+            outcomes[name] = [recorded[(name, trial)]
+                              for trial in range(counts[name])]
+    
+    # Record results (number of successes, failures and timeouts)
+    for name in PROTOCOLS:
+        for (c, timer, success, failure, timeout) in outcomes[name]:
             if (success):
-                results['SPI']['rounds'].append(r)
-                results['SPI']['times'].append(timer)
-                results['SPI']['sNumber'] += 1
+                results[name][lengths].append(c)
+                results[name][times].append(timer)
+                results[name]['sNumber'] += 1
             elif (failure):
-                results['SPI']['fNumber'] += 1
+                results[name]['fNumber'] += 1
             elif (timeout):
-                results['SPI']['tNumber'] += 1
-                
-        # Calculate averages and success rates
-        # ANY
-        if (len(results['ANY']['rounds']) > 0):
-            results['ANY']['avgRounds'] = sum(
-                results['ANY']['rounds'])/results['ANY']['sNumber']
-            results['ANY']['avgTime'] = sum(
-                results['ANY']['times'])/results['ANY']['sNumber']
-        else:
-            results['ANY']['avgRounds'] = None
-            results['ANY']['avgTime'] = None
-        results['ANY']['sRate'] = results['ANY']['sNumber']/trials
-        results['ANY']['fRate'] = results['ANY']['fNumber']/trials
-        results['ANY']['tRate'] = results['ANY']['tNumber']/trials
-        # CO
-        if (len(results['CO']['rounds']) > 0):
-            results['CO']['avgRounds'] = sum(
-                results['CO']['rounds'])/results['CO']['sNumber']
-            results['CO']['avgTime'] = sum(
-                results['CO']['times'])/results['CO']['sNumber']
-        else:
-            results['CO']['avgRounds'] = None
-            results['CO']['avgTime'] = None
-        results['CO']['sRate'] = results['CO']['sNumber']/trials
-        results['CO']['fRate'] = results['CO']['fNumber']/trials
-        results['CO']['tRate'] = results['CO']['tNumber']/trials
-        # LNS
-        if (len(results['LNS']['rounds']) > 0):
-            results['LNS']['avgRounds'] = sum(
-                results['LNS']['rounds'])/results['LNS']['sNumber']
-            results['LNS']['avgTime'] = sum(
-                results['LNS']['times'])/results['LNS']['sNumber']
-        else:
-            results['LNS']['avgRounds'] = None
-            results['LNS']['avgTime'] = None
-        results['LNS']['sRate'] = results['LNS']['sNumber']/trials
-        results['LNS']['fRate'] = results['LNS']['fNumber']/trials
-        results['LNS']['tRate'] = results['LNS']['tNumber']/trials
-        # TOK
-        if (len(results['TOK']['rounds']) > 0):
-            results['TOK']['avgRounds'] = sum(
-                results['TOK']['rounds'])/results['TOK']['sNumber']
-            results['TOK']['avgTime'] = sum(
-                results['TOK']['times'])/results['TOK']['sNumber']
-        else:
-            results['TOK']['avgRounds'] = None
-            results['TOK']['avgTime'] = None
-        results['TOK']['sRate'] = results['TOK']['sNumber']/trials
-        results['TOK']['fRate'] = results['TOK']['fNumber']/trials
-        results['TOK']['tRate'] = results['TOK']['tNumber']/trials
-        # SPI
-        if (len(results['SPI']['rounds']) > 0):
-            results['SPI']['avgRounds'] = sum(
-                results['SPI']['rounds'])/results['SPI']['sNumber']
-            results['SPI']['avgTime'] = sum(
-                results['SPI']['times'])/results['SPI']['sNumber']
+                results[name]['tNumber'] += 1
+    
+    # Calculate averages, success rates and their confidence intervals
+    for name in PROTOCOLS:
+        number = len(outcomes[name])
+        if (len(results[name][lengths]) > 0):
+            results[name][avgLength] = sum(
+                results[name][lengths])/results[name]['sNumber']
+            results[name]['avgTime'] = sum(
+                results[name][times])/results[name]['sNumber']
         else:
-            results['SPI']['avgRounds'] = None
-            results['SPI']['avgTime'] = None
-        results['SPI']['sRate'] = results['SPI']['sNumber']/trials
-        results['SPI']['fRate'] = results['SPI']['fNumber']/trials
-        results['SPI']['tRate'] = results['SPI']['tNumber']/trials
+            results[name][avgLength] = None
+            results[name]['avgTime'] = None
+        results[name]['sRate'] = results[name]['sNumber']/number
+        results[name]['fRate'] = results[name]['fNumber']/number
+        results[name]['tRate'] = results[name]['tNumber']/number
+        results[name]['trials'] = number
+        results[name]['lengthCI'] = lengthInterval(results[name][lengths])
+        results[name]['sRateCI'] = rateInterval(results[name]['sNumber'],
+                                                number)
         
     return results
 
@@ -344,9 +551,36 @@ def testProtocols(n, top, trials, rounds = False):
 #                      (true) or not (false)
 #             minN - minimum number of agents to test for 
 #                   (must be multiple of 5)
+#             batch - boolean, dictates if trials are executed in 
+#                     lockstep batches (see testProtocols)
+#             workers - int, number of processes trials are executed on
+#                       (see testProtocols)
+#             seed - int, master seed making results reproducible
+#                    (see testProtocols)
+#             budget - int, maximum number of calls (or rounds) of each
+#                      execution (None uses defaultBudget(n), or
+#                      defaultRoundBudget(n) in rounds, for each n)
+#             timeLimit - float, optional wall-clock limit in seconds of
+#                         each execution (see testProtocols)
+#             path - string, path of an append-only results file each 
+#                    trial is streamed to, from which an interrupted 
+#                    sweep is resumed (see testProtocols)
+#             traceDir - string, directory the call traces of 
+#                        unsuccessful trials are saved to (see runTrial)
+#             width - float, target width of the confidence interval of
+#                     each protocol, making trials the minimum number of
+#                     trials for each value of n (see testProtocols)
+#             statistic, maxTrials, timeBudget - interval the width
+#                     applies to, maximum number of trials and execution
+#                     time budget of each protocol for each value of n
+#                     (see testProtocols)
 # Returns - dictionary - contains all results for all n
 
-def experiment(maxN, top, trials, rounds = False, minN = 5):
+def experiment(maxN, top, trials, rounds = False, minN = 5, 
+               batch = False, workers = None, seed = None, 
+               budget = None, timeLimit = None, path = None,
+               traceDir = None, width = None, statistic = 'length',
+               maxTrials = None, timeBudget = None):
     # Case where calls are made sequentially
     if (not rounds):
         # Execution lengths
@@ -363,7 +597,10 @@ def experiment(maxN, top, trials, rounds = False, minN = 5):
         # Produce results for all values of 5n up to maxN
         for n in range(minN, maxN+1, 5):
             # Calculate execution length, time e.t.c.
-            results = testProtocols(n, top, trials, rounds)
+            results = testProtocols(n, top, trials, rounds, batch,
+                                    workers, seed, budget, timeLimit,
+                                    path, traceDir, width, statistic,
+                                    maxTrials, timeBudget)
             print("Progress: "+str(n)+" agents complete.")
             
             # Record ANY results
@@ -468,7 +705,10 @@ def experiment(maxN, top, trials, rounds = False, minN = 5):
         # Produce results for all values of 5n up to maxN
         for n in range(minN, maxN+1, 5):
             # Calculate execution length, time e.t.c.
-            results = testProtocols(n, top, trials, rounds)
+            results = testProtocols(n, top, trials, rounds, batch,
+                                    workers, seed, budget, timeLimit,
+                                    path, traceDir, width, statistic,
+                                    maxTrials, timeBudget)
             print("Progress: "+str(n)+" agents complete.")
             
             # Record ANY results
@@ -13,22 +13,125 @@ import time
 import copy
 import pickle
 
+# ===============================================================
+#  Useful tools
+# ===============================================================
+
+# randomTree(n, rng) - generates a uniformly random labelled tree on 
+#                      n vertices (from a random Prufer sequence)
+# Parameters: n - number of agents/nodes
+#             rng - NumPy random generator
+# Returns - tree graph object with nodes 0,...,n-1
+
+def randomTree(n, rng):
+    if (n < 2):
+        G = nx.Graph()
+        G.add_nodes_from(range(n))
+        return G
+    return nx.from_prufer_sequence(rng.integers(n, size=n-2).tolist())
+
+
+# pairIndex(i, j) - index of the unordered pair {i,j} (i < j) when the
+#                   pairs are listed as (0,1), (0,2), (1,2), (0,3), ...
+# Parameters: i, j - NumPy arrays of ints, with i < j
+# Returns - NumPy array of ints, index of each pair
+
+def pairIndex(i, j):
+    return j * (j - 1)//2 + i
+
+
+# pairFromIndex(index) - inverse of pairIndex
+# Parameters: index - NumPy array of ints, pair indices
+# Returns - tuple (i, j) of NumPy arrays of ints, with i < j
+
+def pairFromIndex(index):
+    index = np.asarray(index, dtype=np.int64)
+    j = ((1 + np.sqrt(1 + 8 * index.astype(float)))//2).astype(np.int64)
+    # Correct rounding errors of the square root
+    j -= (j * (j - 1)//2 > index)
+    j += ((j + 1) * j//2 <= index)
+    return (index - j * (j - 1)//2, j)
+
+
+# arcIndex(i, j, n) - index of the arc (i,j) (i != j) when the arcs
+#                     are listed as (0,1), ..., (0,n-1), (1,0), (1,2), ...
+# Parameters: i, j - NumPy arrays of ints, with i != j
+#             n - number of agents/nodes
+# Returns - NumPy array of ints, index of each arc
+
+def arcIndex(i, j, n):
+    return i * (n - 1) + j - (j > i)
+
+
+# arcFromIndex(index, n) - inverse of arcIndex
+# Parameters: index - NumPy array of ints, arc indices
+#             n - number of agents/nodes
+# Returns - tuple (i, j) of NumPy arrays of ints, with i != j
+
+def arcFromIndex(index, n):
+    (i, j) = np.divmod(np.asarray(index, dtype=np.int64), n - 1)
+    return (i, j + (j >= i))
+
+
+# sampleIndices(N, k, excluded, rng) - samples k distinct ints from 
+#                                     0,...,N-1 other than those in
+#                                     excluded, uniformly at random
+# Parameters: N - int, size of the range
+#             k - int, number of samples
+#             excluded - NumPy array of distinct ints in the range
+#             rng - NumPy random generator
+# Returns - NumPy array of k ints
+#
+# Samples are drawn from the N - len(excluded) allowed ints directly and
+# then shifted past the excluded ints below them, so no sample is ever
+# rejected.
+
+def sampleIndices(N, k, excluded, rng):
+    x = rng.choice(N - len(excluded), size=k, replace=False)
+    # The m-th smallest excluded int has m allowed ints below it less 
+    # than its value, so x is shifted past the excluded ints e with 
+    # e - m <= x
+    shift = np.sort(excluded) - np.arange(len(excluded))
+    return x + np.searchsorted(shift, x, side='right')
+
+
 # ===============================================================
 #  Complete (gossip) graph generator
 # ===============================================================
 
-# completeGraph(n, plot) - generate a complete gossip graph on 
-#                          n vertices
+# completeGraph(n, plot, implicit) - generate a complete gossip graph 
+#                                    on n vertices
 # Parameters: n - number of agents/nodes
 #             plot - boolean, dicates if final network is plotted
+#             implicit - boolean, if true the edges and node attributes
+#                        are not stored (only sequential calls)
 # Returns - complete (gossip) graph object with n nodes
+#
+# An implicit complete graph has n nodes, no edges and the graph 
+# attribute 'implicit', and protocols sample its calls without ever
+# listing them, so very large n can be simulated. Its final state is 
+# never written back into its nodes (contacts are only recorded under
+# CO), so it should be executed on a GossipState, from which the final
+# secrets are read.
 
-def completeGraph(n, plot = False):
+def completeGraph(n, plot = False, implicit = False):
+    # Implicit complete graph (initial values are used for agents 
+    # without attributes)
+    if (implicit):
+        G = nx.empty_graph(n)
+        G.graph['initial'] = True
+        G.graph['implicit'] = True
+        return G
+    
     # Initialise complete graph using nx
     G = nx.complete_graph(n)
     # Indicate G is an initial gossip graph
     G.graph['initial'] = True
     
+    # Cache the directed arcs of G (each edge of a graph gives two
+    # arcs), from which the initial permitted calls are built
+    G.graph['arcs'] = tuple((i, j) for i in range(n) for j in G.adj[i])
+    
     # Add attributes to nodes (agents)
     for agent in list(range(n)):
         # Initial secret
@@ -59,34 +162,51 @@ def completeGraph(n, plot = False):
 #  Random incomplete (gossip) graph generator
 # ===============================================================
 
-# incompleteGraph(n) - generate a random incomplete gossip graph 
-#                      on n vertices
+# incompleteGraph(n, plot, extra) - generate a random incomplete 
+#                                   gossip graph on n vertices
 # Parameters: n - number of agents/nodes
 #             plot - boolean, dicates if final network is plotted
+#             extra - int, number of edges added to the random tree
+#                     (None picks it uniformly at random between 0 and
+#                     the number of pairs not in the tree)
 # Returns - graph object with n nodes
+#
+# The extra edges are a uniformly random set of pairs outside the tree,
+# sampled directly by pair index and added in bulk. With extra = None
+# the graph has about n^2/4 edges on average, so large sparse graphs 
+# should be generated with an explicit number of extra edges.
 
-def incompleteGraph(n, plot = False):
-    # Generate initial random tree using nx
-    G = nx.random_tree(n)
-    # Indicate G is an initial gossip graph
-    G.graph['initial'] = True
+def incompleteGraph(n, plot = False, extra = None):
+    # Random generator (seeded from random, so random.seed applies)
+    rng = np.random.default_rng(random.getrandbits(64))
+    
+    # Generate initial random tree
+    T = randomTree(n, rng)
     
     # Calculate maximum number of extra edges to add
-    nC2 = factorial(n)/(2 * factorial(n - 2))
+    nC2 = n * (n - 1)//2
     epsilon = nC2 - (n-1)
     
     # Generate random number of edges to add
-    r = random.randint(0, epsilon)
-    
-    # Add edges to G until limit reached
-    while (G.number_of_edges() < (n-1) + r):
-        # Pick random pair of nodes in G
-        i = random.randint(0, n-1)
-        j = random.randint(0, n-1)
-        
-        # Add edge (i,j) to G if edge doesn't already exist
-        if (((i,j) not in G.edges) and (i != j)):
-            G.add_edge(*(i,j))
+    if (extra is None):
+        extra = random.randint(0, max(epsilon, 0))
+    
+    # Sample extra edges from the pairs not in the tree
+    edges = np.array(T.edges, dtype=np.int64).reshape(-1, 2)
+    treePairs = pairIndex(edges.min(axis=1), edges.max(axis=1))
+    (u, v) = pairFromIndex(sampleIndices(nC2, extra, treePairs, rng))
+    
+    # Build G from the tree and extra edges
+    G = nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(T.edges)
+    G.add_edges_from(zip(u.tolist(), v.tolist()))
+    # Indicate G is an initial gossip graph
+    G.graph['initial'] = True
+    
+    # Cache the directed arcs of G (each edge of a graph gives two
+    # arcs), from which the initial permitted calls are built
+    G.graph['arcs'] = tuple((i, j) for i in range(n) for j in G.adj[i])
     
     # Add attributes to nodes
     for agent in list(range(n)):
@@ -118,55 +238,55 @@ def incompleteGraph(n, plot = False):
 #  Random (gossip) digraph generator
 # ===============================================================
 
-# diGraph(n) - generate a random gossip digraph on n vertices
+# diGraph(n, plot, extra) - generate a random gossip digraph on 
+#                           n vertices
 # Parameters: n - number of agents/nodes
 #             plot - boolean, dicates if final network is plotted
+#             extra - int, number of arcs added to the randomly 
+#                     oriented tree (None picks it uniformly at random
+#                     between 0 and a tenth of the arcs not in the tree)
 # Returns - graph object with n nodes
+#
+# Each edge of a random tree is given a random direction and the extra
+# arcs are a uniformly random set of arcs (i,j) outside the tree, 
+# sampled directly by arc index and added in bulk (so the reverse of a 
+# tree arc may be added). No n x n matrix is built.
 
-def diGraph(n, plot = False):
+def diGraph(n, plot = False, extra = None):
+    # Random generator (seeded from random, so random.seed applies)
+    rng = np.random.default_rng(random.getrandbits(64))
+    
     # Generate intial random tree
-    G = nx.random_tree(n)
-    
-    # Create digraph using the edges of G (each edge becomes two arcs)
-    G = nx.DiGraph(G)
-    
-    # Fetch adjacency matrix of G
-    A = np.array(nx.adjacency_matrix(G).todense())
-    
-    # Loop through all pairs of vertices
-    for i in list(range(n)):
-        for j in list(range(i)):
-            # Check if an arc exists between nodes i and j 
-            # (and hence vice versa)
-            if (A[i,j] == 1):
-                # If so, remove either arc (i,j) or (j,i) (at random)
-                rand = random.randint(0,1)
-                if (rand == 0):
-                    A[i,j] = 0
-                else:
-                    A[j,i] = 0
-    
-    # Convert matrix back into NetwrokX digraph object
-    G = nx.convert_matrix.from_numpy_matrix(A, create_using=(nx.DiGraph))
-    # Indicate G is an initial gossip graph
-    G.graph['initial'] = True
+    T = randomTree(n, rng)
+    
+    # Give each edge of the tree a random direction
+    edges = np.array(T.edges, dtype=np.int64).reshape(-1, 2)
+    flip = rng.random(len(edges)) < 0.5
+    edges[flip] = edges[flip, ::-1]
     
     # Calculate maximum number of extra arcs to add (restricted)
-    nC2 = factorial(n)/(2 * factorial(n - 2))
+    nC2 = n * (n - 1)//2
     epsilon = int(((2 * nC2) - (n-1))/10)
     
     # Generate random number of arcs to add
-    r = random.randint(0, epsilon)
-    
-    # Add arcs to G until limit reached
-    while (G.number_of_edges() < (n-1) + r):
-        # Pick random pair of nodes in G
-        i = random.randint(0, n-1)
-        j = random.randint(0, n-1)
-        
-        # Add arc (i,j) to G if arc doesn't already exist
-        if (((i,j) not in G.edges) and (i != j)):
-            G.add_edge(*(i,j))
+    if (extra is None):
+        extra = random.randint(0, max(epsilon, 0))
+    
+    # Sample extra arcs from the arcs not in the tree
+    treeArcs = arcIndex(edges[:, 0], edges[:, 1], n)
+    (u, v) = arcFromIndex(sampleIndices(2 * nC2, extra, treeArcs, rng), n)
+    
+    # Build G from the tree arcs and extra arcs
+    G = nx.DiGraph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(edges.tolist())
+    G.add_edges_from(zip(u.tolist(), v.tolist()))
+    # Indicate G is an initial gossip graph
+    G.graph['initial'] = True
+    
+    # Cache the arcs of G, from which the initial permitted calls 
+    # are built
+    G.graph['arcs'] = tuple((i, j) for i in range(n) for j in G.adj[i])
     
     # Add additional attributes to nodes
     for agent in list(range(n)):
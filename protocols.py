@@ -1,6 +1,15 @@
 '''This file contains:
     - Prerequisite functions to check for an all-expert state
       and to check if an individual call is permitted
+    - Bitset tools used to store sets of agents compactly
+    - A compact gossip state class on which protocols are executed
+    - A call pool class used to store permitted calls, and a call
+      sampler class which only stores the number of permitted calls
+      of each agent (in a Fenwick tree), with a token pool variant
+      used under TOK and SPI
+    - Functions to execute an individual call
+    - Tools to profile executions, and to record call traces of
+      executions and replay them
     - Functions to execute a chosen protocol sequentially and
       in rounds
     - Five indivdual protocol functions used to return 
@@ -17,6 +26,7 @@ import random
 import time
 import copy
 import pickle
+from array import array
 
 # ===============================================================
 #  Useful tools
@@ -42,44 +52,1061 @@ def experts(G):
             break
     
     return s
+
+
+# countExperts(S) - counts the number of expert agents of S
+# Parameters: S - GossipState of a gossip graph
+# Returns: int, number of agents that know all secrets
+
+def countExperts(S):
+    return S.secrets.count(S.full)
         
 
-# pPermitted(G, P, caller, callee) - checks if (caller, callee) is a P 
+# pPermitted(S, P, caller, callee) - checks if (caller, callee) is a P 
 #                                 permitted call
-# Parameters: G - graph object,
+# Parameters: S - GossipState of a gossip graph,
 #             P - predefined protocol function,
 #             caller - int, index of caller agent
 #             callee - int, index of callee agent
 # Returns: boolean - true if call is permitted, false otherwise
 
-def pPermitted(G, P, caller, callee):
+def pPermitted(S, P, caller, callee):
     # ANY - always p permitted
     if (P == ANY):
         return True
     # CO - p permitted if agents have not been in contact
     elif (P == CO):
-        if (caller not in G.nodes[callee]['contacts']):
+        if (not (S.contacts[callee] >> caller) & 1):
             return True
     # LNS - p permitted if caller does not know callee's secret
     elif (P == LNS):
-        if (callee not in G.nodes[caller]['secrets']):
+        if (not (S.secrets[caller] >> callee) & 1):
             return True
     # TOK and SPI - p permitted if caller has a token
     elif (P == TOK or P == SPI):
-        if (G.nodes[caller]['token']):
+        if (S.token[caller]):
             return True
     return False
 
 
+# spreads(S, i, j) - checks if the call (i,j) would change what i and j
+#                    know
+# Parameters: S - GossipState of a gossip graph,
+#             i, j - int, indices of caller and callee agents
+# Returns: boolean - true if i and j know different secrets (or, in the
+#          dynamic case, different numbers), false otherwise
+
+def spreads(S, i, j):
+    if (S.secrets[i] != S.secrets[j]):
+        return True
+    return S.dynamic and S.numbers[i] != S.numbers[j]
+
+
+# stuck(S, P, calls) - checks if protocol P can no longer succeed on S
+# Parameters: S - GossipState of a gossip graph,
+#             P - predefined protocol function,
+#             calls - CallPool or CallSampler of P permitted calls
+# Returns: boolean - true if success has become impossible
+#
+# Under CO and SPI a call that spreads no knowledge only removes 
+# permitted calls (a past contact, or the callee's token), so once no 
+# permitted call spreads knowledge none ever will again. The other 
+# protocols are never reported stuck: an LNS call always spreads a 
+# secret, and a TOK call that spreads nothing still moves a token.
+#
+# The calls of a CallSampler are not listed. Instead agents are grouped
+# by the secrets (and numbers) they know, and a permitted call spreads 
+# knowledge if an agent with permitted calls may call an agent outside
+# its group, which takes O(n) bitset operations.
+
+def stuck(S, P, calls):
+    if (P != CO and P != SPI):
+        return False
+    if (isinstance(calls, CallSampler)):
+        # Bitset of the agents knowing the same as each agent
+        keys = S.secrets
+        if (S.dynamic):
+            keys = list(zip(S.secrets, S.numbers))
+        groups = {}
+        for agent in range(S.n):
+            groups[keys[agent]] = groups.get(keys[agent], 0) | (1 << agent)
+        
+        for agent in range(S.n):
+            if (calls.weights[agent] > 0 and
+                calls.callees(agent) & ~groups[keys[agent]]):
+                return False
+        return True
+    for (i, j) in calls:
+        if (spreads(S, i, j)):
+            return False
+    return True
+
+
+# defaultBudget(n) - default maximum number of calls of an execution on
+#                    n agents before it is timed out
+# Parameters: n - int, number of agents
+# Returns: int, call budget
+#
+# Random calls on the worst topologies (e.g. TOK on a lollipop graph)
+# need about n^3/2 calls to succeed, so n^3 + 100n^2 leaves a wide 
+# margin over every successful execution seen while stopping executions
+# that are stuck for good. Unlike a wall-clock limit, the budget does 
+# not depend on the machine or its load.
+
+def defaultBudget(n):
+    return n**3 + 100 * n**2
+
+
+# defaultRoundBudget(n) - default maximum number of rounds of an 
+#                         execution on n agents before it is timed out
+# Parameters: n - int, number of agents
+# Returns: int, round budget
+#
+# A round makes up to n/2 calls, so the call budget is divided by n/2,
+# and executions in rounds time out after about as many calls as
+# sequential ones. The slowest rounds seen (TOK on incomplete graphs,
+# where late rounds make few calls) stay well within the budget.
+
+def defaultRoundBudget(n):
+    return defaultBudget(n)//max(n//2, 1)
+
+
 # ===============================================================
-#  Protocol execution function
+#  Bitset tools
+# ===============================================================
+
+# Sets of agents (secrets, contacts and numbers) are stored as python 
+# ints, where bit k is set if agent k is in the set. Two sets are then 
+# merged with a bitwise or and their sizes found with a popcount.
+
+# toBitset(s) - packs a set of agents into a bitset
+# Parameters: s - iterable of ints, agent indices
+# Returns: b - int, bit k of b is set iff k is in s
+
+def toBitset(s):
+    b = 0
+    for k in s:
+        b |= 1 << k
+    return b
+
+
+# bitsetMembers(b) - yields the agents in bitset b in ascending order
+# Parameters: b - int, bitset of agents
+# Returns: generator of ints, indices of the set bits of b
+
+def bitsetMembers(b):
+    # Binary digits of b, least significant first
+    digits = bin(b)[:1:-1]
+    k = digits.find('1')
+    while (k >= 0):
+        yield k
+        k = digits.find('1', k + 1)
+
+
+# bitsetSelect(b, r) - returns the r-th smallest agent in bitset b
+#                      (counting from 0), halving b with popcounts
+#                      so only O(log n) bitwise operations are made
+# Parameters: b - int, bitset of agents
+#             r - int, 0 <= r < number of agents in b
+# Returns: int, index of the r-th set bit of b
+
+def bitsetSelect(b, r):
+    offset = 0
+    width = b.bit_length()
+    while (width > 64):
+        # Keep the half of b holding the r-th set bit
+        half = width // 2
+        low = b & ((1 << half) - 1)
+        count = low.bit_count()
+        if (r < count):
+            b, width = low, half
+        else:
+            r -= count
+            b >>= half
+            offset += half
+            width = b.bit_length()
+    
+    # Find the r-th set bit of the remaining word
+    for _ in range(r):
+        b &= b - 1
+    return offset + (b & -b).bit_length() - 1
+
+
+# fromBitset(b) - unpacks a bitset into a set of agents
+# Parameters: b - int, bitset of agents
+# Returns: set of ints, agent indices held in b
+
+def fromBitset(b):
+    return set(bitsetMembers(b))
+
+
+# ===============================================================
+#  Compact gossip state
 # ===============================================================
 
-# executeProtocol(G, P, breakdown) - executes protocol P on graph G
+# GossipState(G, sampled) - compact state of gossip graph G, on which 
+#                           the protocols are executed in place of the
+#                           networkx node attribute dictionaries
 # Parameters: G - graph object, generated in "graph_generator.py"
-#             P - function,  returns list of P permitted calls
+#             sampled - boolean, if true permitted calls are held in a
+#                       CallSampler rather than a CallPool (always the
+#                       case for implicit complete graphs)
+#
+# Agents are the integers 0,...,n-1. The state holds:
+#     n - int, number of agents
+#     full - int, bitset of all n agents
+#     dynamic - boolean, true if G is a (dynamic gossip) digraph
+#     implicit - boolean, true if G is a complete graph whose edges 
+#                are not stored (see completeGraph), in which case the
+#                arcs are never materialised
+#     sampled - boolean, true if permitted calls are held in a 
+#               CallSampler (sequential calls only)
+#     initial - boolean, true if G is an initial gossip graph
+#     indptr, indices - NumPy arrays, arcs of G in compressed sparse
+#                       row form (the neighbours of agent i are 
+#                       indices[indptr[i]:indptr[i+1]])
+#     secrets - list of bitsets, secrets known by each agent
+#     contacts - list of bitsets, past contacts of each agent
+#     token - bytearray, 1 if an agent holds a token and 0 otherwise
+#     numbers - list of bitsets, numbers known by each agent
+#     adj, out - lists of neighbours and bitsets of neighbours of each
+#                agent, which grow as arcs are added (dynamic case 
+#                only, None otherwise)
+#     unknown, learned - LNS candidate index and the secrets learned 
+#                        in the latest call (LNS only)
+#     saved - tuple, snapshot of the mutable state taken on creation
+#     cached - tuple of arcs (i,j) cached on G by the graph generator
+#              (None if G has no cached arcs)
+#     pool, added - CallPool of the initial arcs (built on first use)
+#                   and the number of arcs added since the snapshot
+#     bits - list of bitsets of neighbours of each agent of a static
+#            graph (built on first use, None otherwise)
+#
+# The topology (indptr, indices) is never modified, so one state can be
+# executed on repeatedly: reset() restores the snapshot in O(n) (plus
+# the arcs in the dynamic case) instead of deep-copying the graph.
+
+class GossipState:
+    __slots__ = ('n', 'full', 'dynamic', 'implicit', 'sampled', 
+                 'initial', 'indptr', 'indices',
+                 'secrets', 'contacts', 'token', 'numbers', 'adj', 'out',
+                 'unknown', 'learned', 'saved', 'cached', 'pool', 
+                 'added', 'bits')
+    
+    def __init__(self, G, sampled = False):
+        n = G.number_of_nodes()
+        self.n = n
+        self.full = (1 << n) - 1
+        self.dynamic = G.is_directed()
+        self.implicit = G.graph.get('implicit', False)
+        self.sampled = sampled or self.implicit
+        self.bits = None
+        self.initial = G.graph.get('initial', True)
+        
+        # Build the CSR adjacency of G
+        degrees = np.fromiter((len(G.adj[agent]) for agent in range(n)),
+                              dtype=np.int64, count=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degrees, out=self.indptr[1:])
+        self.indices = np.fromiter((k for agent in range(n) 
+                                    for k in G.adj[agent]),
+                                   dtype=np.int32, count=self.indptr[-1])
+        
+        # Fetch agent attributes (or their initial values if G has none)
+        nodes = G.nodes
+        if (n > 0 and 'secrets' in nodes[0]):
+            self.secrets = [toBitset(nodes[agent]['secrets']) 
+                            for agent in range(n)]
+            self.contacts = [toBitset(nodes[agent]['contacts']) 
+                             for agent in range(n)]
+            self.token = bytearray(bool(nodes[agent]['token']) 
+                                   for agent in range(n))
+            self.numbers = [toBitset(nodes[agent]['numbers']) 
+                            for agent in range(n)]
+        else:
+            self.secrets = [1 << agent for agent in range(n)]
+            self.contacts = [0] * n
+            self.token = bytearray([1]) * n
+            if (self.implicit):
+                self.numbers = [self.full] * n
+            else:
+                self.numbers = [toBitset(G.adj[agent]) | (1 << agent)
+                                for agent in range(n)]
+        
+        # Initial arcs cached by the graph generator (if any)
+        self.cached = G.graph.get('arcs')
+        self.pool = None
+        
+        # Snapshot of the mutable state
+        self.saved = (self.initial, self.secrets.copy(), 
+                      self.contacts.copy(), bytes(self.token), 
+                      self.numbers.copy())
+        self.resetArcs()
+    
+    # resetArcs() - discards arcs added during execution (dynamic case),
+    #               the LNS candidate index and the latest changes
+    def resetArcs(self):
+        # Arcs are only added to digraphs (dynamic case)
+        self.adj, self.out = None, None
+        if (self.dynamic):
+            self.adj = [self.neighbours(agent) for agent in range(self.n)]
+            self.out = [toBitset(neighbours) for neighbours in self.adj]
+        self.added = 0
+        
+        self.unknown, self.learned = None, None
+    
+    # reset() - restores the state to the snapshot taken on creation
+    def reset(self):
+        (initial, secrets, contacts, token, numbers) = self.saved
+        self.initial = initial
+        self.secrets = secrets.copy()
+        self.contacts = contacts.copy()
+        self.token = bytearray(token)
+        self.numbers = numbers.copy()
+        self.resetArcs()
+    
+    # neighbours(i) - returns the list of neighbours of agent i
+    def neighbours(self, i):
+        if (self.implicit):
+            return [k for k in range(self.n) if k != i]
+        if (self.adj is not None):
+            return self.adj[i]
+        return self.indices[self.indptr[i]:self.indptr[i + 1]].tolist()
+    
+    # degree(i) - returns the number of neighbours of agent i
+    def degree(self, i):
+        if (self.implicit):
+            return self.n - 1
+        if (self.adj is not None):
+            return len(self.adj[i])
+        return int(self.indptr[i + 1] - self.indptr[i])
+    
+    # neighbour(i, k) - returns the k-th neighbour of agent i
+    def neighbour(self, i, k):
+        if (self.implicit):
+            return k + (k >= i)
+        if (self.adj is not None):
+            return self.adj[i][k]
+        return int(self.indices[self.indptr[i] + k])
+    
+    # outBits(i) - returns the bitset of neighbours of agent i
+    def outBits(self, i):
+        if (self.implicit):
+            return self.full & ~(1 << i)
+        if (self.out is not None):
+            return self.out[i]
+        if (self.bits is None):
+            self.bits = [toBitset(self.neighbours(agent)) 
+                         for agent in range(self.n)]
+        return self.bits[i]
+    
+    # arcs() - returns the list of arcs (i,j) of the gossip graph
+    def arcs(self):
+        if (self.implicit):
+            return [(i, j) for i in range(self.n) for j in range(self.n)
+                    if i != j]
+        if (self.adj is not None):
+            return [(i, j) for i in range(self.n) for j in self.adj[i]]
+        callers = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        return list(zip(callers.tolist(), self.indices.tolist()))
+    
+    # initialCalls(P) - returns a new CallPool of the P permitted arcs,
+    #                   copied from the cached pool of initial arcs where
+    #                   possible (a TokenPool under TOK and SPI, and a 
+    #                   CallSampler of protocol P if S is sampled). Every
+    #                   arc is permitted on an initial gossip graph, 
+    #                   otherwise each is checked with pPermitted (e.g. 
+    #                   when an execution is continued)
+    def initialCalls(self, P):
+        if (P == TOK or P == SPI):
+            return TokenPool(self, P)
+        if (self.sampled):
+            return CallSampler(self, P)
+        if (not self.initial):
+            return CallPool(call for call in self.arcs()
+                            if pPermitted(self, P, *call))
+        # Arcs added during execution are not in the cached pool
+        if (self.added != 0):
+            return CallPool(self.arcs())
+        if (self.pool is None):
+            if (self.cached is not None):
+                self.pool = CallPool(self.cached)
+            else:
+                self.pool = CallPool(self.arcs())
+        return self.pool.copy()
+    
+    # addArcs(i, b) - adds arcs from i to the agents of bitset b, none 
+    #                 of which i has an arc to (dynamic case)
+    def addArcs(self, i, b):
+        numbers = list(bitsetMembers(b))
+        self.adj[i].extend(numbers)
+        self.out[i] |= b
+        self.added += len(numbers)
+    
+    # writeTo(G) - writes the state back into the node attributes (and
+    #              arcs) of the networkx graph G it was built from (not
+    #              for implicit complete graphs, whose contacts are not
+    #              all recorded, so their state is read from S itself)
+    def writeTo(self, G):
+        if (self.implicit):
+            raise ValueError("the state of an implicit complete graph "
+                             "is not written back (read it from its "
+                             "GossipState)")
+        
+        # Agents that called each other share their secrets and numbers,
+        # so each distinct bitset is only unpacked once
+        unpacked = {}
+        def unpack(b):
+            if (b not in unpacked):
+                unpacked[b] = fromBitset(b)
+            return unpacked[b]
+        
+        for agent in range(self.n):
+            G.nodes[agent]['secrets'] = unpack(self.secrets[agent])
+            G.nodes[agent]['contacts'] = fromBitset(self.contacts[agent])
+            G.nodes[agent]['token'] = bool(self.token[agent])
+            G.nodes[agent]['numbers'] = unpack(self.numbers[agent])
+            
+            # Add arcs created during execution
+            if (self.dynamic):
+                degree = self.indptr[agent + 1] - self.indptr[agent]
+                for k in self.adj[agent][degree:]:
+                    G.add_edge(agent, k)
+        
+        # The cached arcs no longer match G once arcs are added
+        if (self.added != 0):
+            G.graph.pop('arcs', None)
+        
+        G.graph['initial'] = self.initial
+
+
+# ===============================================================
+#  Call pool
+# ===============================================================
+
+# CallPool(calls) - pool of permitted calls supporting O(1) addition,
+#                   removal, membership tests and random sampling
+# Parameters: calls - iterable of tuples (i,j), initial permitted calls
+#
+# The calls are held in a dense list together with a dictionary
+# mapping each call to its position in the list. A call is removed by
+# moving the last call of the list into its position, so calls never
+# have to be searched for or shifted. The pool supports len(), "in",
+# indexing and iteration in the same way as a list of calls.
+
+class CallPool:
+    __slots__ = ('calls', 'index')
+    
+    def __init__(self, calls = ()):
+        # Dense list of calls (duplicates removed, order preserved)
+        self.calls = list(dict.fromkeys(calls))
+        # Position of each call in the dense list
+        self.index = {call: k for k, call in enumerate(self.calls)}
+    
+    def __len__(self):
+        return len(self.calls)
+    
+    def __contains__(self, call):
+        return call in self.index
+    
+    def __getitem__(self, k):
+        return self.calls[k]
+    
+    def __iter__(self):
+        return iter(self.calls)
+    
+    def __repr__(self):
+        return str(self.calls)
+    
+    # append(call) - adds call to the pool (if not already present)
+    def append(self, call):
+        if (call not in self.index):
+            self.index[call] = len(self.calls)
+            self.calls.append(call)
+    
+    # extend(calls) - adds each of the calls to the pool
+    def extend(self, calls):
+        index, dense = self.index, self.calls
+        for call in calls:
+            if (call not in index):
+                index[call] = len(dense)
+                dense.append(call)
+    
+    # remove(call) - removes call from the pool, raising a ValueError
+    #                if it is not present (as list.remove does)
+    def remove(self, call):
+        if (call not in self.index):
+            raise ValueError(str(call)+" not in call pool")
+        self.discard(call)
+    
+    # discard(call) - removes call from the pool if present
+    def discard(self, call):
+        k = self.index.pop(call, None)
+        if (k is None):
+            return
+        # Move the last call into the position of the removed call
+        last = self.calls.pop()
+        if (last != call):
+            self.calls[k] = last
+            self.index[last] = k
+    
+    # discardAll(calls) - removes each of the calls from the pool if 
+    #                     present
+    def discardAll(self, calls):
+        index, dense = self.index, self.calls
+        for call in calls:
+            k = index.pop(call, None)
+            if (k is None):
+                continue
+            last = dense.pop()
+            if (last != call):
+                dense[k] = last
+                index[last] = k
+    
+    # sample() - returns a call chosen uniformly at random
+    def sample(self):
+        return random.choice(self.calls)
+    
+    # randomOrder() - yields the calls of the pool in a uniformly random
+    #                 order, shuffling a copy of the list lazily so only
+    #                 the calls drawn are paid for (the pool may change
+    #                 while the calls are drawn)
+    def randomOrder(self):
+        order = self.calls.copy()
+        for end in range(len(order), 0, -1):
+            # Draw a remaining call and move the last one into its place
+            k = random.randrange(end)
+            call = order[k]
+            order[k] = order[end - 1]
+            yield call
+    
+    # copy() - returns an independent copy of the pool
+    def copy(self):
+        pool = CallPool.__new__(CallPool)
+        pool.calls = self.calls.copy()
+        pool.index = self.index.copy()
+        return pool
+
+
+# ===============================================================
+#  Call sampler
+# ===============================================================
+
+# Fenwick(weights) - Fenwick (binary indexed) tree of non-negative
+#                    integer weights, supporting O(log n) updates and
+#                    O(log n) sampling of an index by weight
+# Parameters: weights - list of ints, initial weight of each index
+
+class Fenwick:
+    __slots__ = ('tree', 'total', 'top')
+    
+    def __init__(self, weights):
+        n = len(weights)
+        # tree[k] holds the sum of the weights of indices k - (k & -k)
+        # up to k - 1 (tree is indexed from 1)
+        tree = [0] + list(weights)
+        for k in range(1, n + 1):
+            parent = k + (k & -k)
+            if (parent <= n):
+                tree[parent] += tree[k]
+        self.tree = tree
+        self.total = sum(weights)
+        # Largest power of two not exceeding n
+        self.top = 1 << (n.bit_length() - 1) if (n > 0) else 0
+    
+    # add(i, delta) - adds delta to the weight of index i
+    def add(self, i, delta):
+        tree = self.tree
+        self.total += delta
+        k = i + 1
+        while (k < len(tree)):
+            tree[k] += delta
+            k += k & -k
+    
+    # find(r) - returns the index i such that the weights of indices
+    #           below i sum to at most r and those up to i to more 
+    #           than r (0 <= r < total)
+    def find(self, r):
+        return self.locate(r)[0]
+    
+    # locate(r) - returns the index i found by find(r), together with r
+    #             less the weights of the indices below i (a uniform 
+    #             offset into the weight of i if r is uniform)
+    def locate(self, r):
+        tree = self.tree
+        i, step = 0, self.top
+        while (step > 0):
+            k = i + step
+            if (k < len(tree) and tree[k] <= r):
+                i = k
+                r -= tree[k]
+            step >>= 1
+        return (i, r)
+
+
+# CallSampler(S, P) - permitted calls of protocol P held as the number
+#                     of permitted calls of each agent, used in place 
+#                     of a CallPool (S.sampled)
+# Parameters: S - GossipState of a gossip graph
+#             P - predefined protocol function
+#
+# No calls are stored. Agent i may call every neighbour outside a 
+# blocked bitset: itself, plus its past contacts under CO, the agents
+# whose secret it knows under LNS, and every agent under TOK and SPI if
+# it holds no token. The number of permitted calls of each agent is 
+# kept in a Fenwick tree, and len() gives their total. A uniform 
+# permitted call is sampled by picking a caller with probability 
+# proportional to its number of permitted calls (O(log n)) and then a 
+# uniform permitted callee, drawing neighbours until one is not blocked
+# while few draws are expected and selecting a random member of the
+# bitset of permitted callees otherwise. The protocols call 
+# refresh(agents) for the agents whose permitted calls a call changed.
+
+class CallSampler:
+    __slots__ = ('S', 'P', 'weights', 'fenwick')
+    
+    # Expected number of draws beyond which callees are selected
+    DRAWS = 16
+    
+    def __init__(self, S, P):
+        self.S, self.P = S, P
+        # Number of permitted calls of each agent
+        self.weights = [self.count(agent) for agent in range(S.n)]
+        self.fenwick = Fenwick(self.weights)
+    
+    def __len__(self):
+        return self.fenwick.total
+    
+    def __repr__(self):
+        return "<"+str(self.fenwick.total)+" sampled calls>"
+    
+    # blocked(i) - returns the bitset of agents i may not call
+    def blocked(self, i):
+        S, P = self.S, self.P
+        if (P == CO):
+            return S.contacts[i] | (1 << i)
+        elif (P == LNS):
+            return S.secrets[i] | (1 << i)
+        elif ((P == TOK or P == SPI) and not S.token[i]):
+            return S.full
+        return 1 << i
+    
+    # callees(i) - returns the bitset of permitted callees of agent i
+    def callees(self, i):
+        return self.S.outBits(i) & ~self.blocked(i)
+    
+    # count(i) - returns the number of permitted calls of agent i
+    def count(self, i):
+        S, P = self.S, self.P
+        if (P == ANY or ((P == TOK or P == SPI) and S.token[i])):
+            return S.degree(i)
+        elif (S.implicit):
+            return S.n - self.blocked(i).bit_count()
+        return self.callees(i).bit_count()
+    
+    # refresh(agents) - recounts the permitted calls of the agents
+    def refresh(self, agents):
+        for agent in agents:
+            weight = self.count(agent)
+            if (weight != self.weights[agent]):
+                self.fenwick.add(agent, weight - self.weights[agent])
+                self.weights[agent] = weight
+    
+    # sample() - returns a permitted call chosen uniformly at random
+    def sample(self):
+        S = self.S
+        
+        # Pick caller i with probability proportional to its weight
+        i = self.fenwick.find(random.randrange(self.fenwick.total))
+        
+        # Pick callee j uniformly among the permitted callees of i
+        degree = S.degree(i)
+        if (self.weights[i] == degree):
+            j = S.neighbour(i, random.randrange(degree))
+        elif (self.weights[i] * self.DRAWS >= degree):
+            blocked = self.blocked(i)
+            while (True):
+                j = S.neighbour(i, random.randrange(degree))
+                if (not (blocked >> j) & 1):
+                    break
+        else:
+            j = bitsetSelect(self.callees(i), 
+                             random.randrange(self.weights[i]))
+        
+        return (i, j)
+
+
+# TokenPool(S, P) - permitted calls of TOK or SPI, held as a 
+#                   CallSampler which also supports "in", iteration and
+#                   randomOrder() in the same way as a CallPool
+# Parameters: S - GossipState of a gossip graph
+#             P - predefined protocol function (TOK or SPI)
+#
+# An agent holding a token may call all of its neighbours and any other
+# agent may call none, so a call only changes the number of permitted 
+# calls of its two agents. Recounting them in the Fenwick tree takes 
+# O(log n), where adding and removing the calls of the agents in a 
+# CallPool takes O(degree). The calls are only listed when iterated 
+# over (e.g. once per round).
+
+class TokenPool(CallSampler):
+    __slots__ = ()
+    
+    def __contains__(self, call):
+        (i, j) = call
+        return bool(self.S.token[i]) and bool((self.S.outBits(i) >> j) & 1)
+    
+    def __iter__(self):
+        return iter(self.calls())
+    
+    def __repr__(self):
+        return str(self.calls())
+    
+    # calls() - returns the list of permitted calls
+    def calls(self):
+        S, weights = self.S, self.weights
+        return [(i, k) for i in range(S.n) if weights[i] > 0
+                for k in S.neighbours(i)]
+    
+    # count(i) - returns the number of permitted calls of agent i
+    def count(self, i):
+        return self.S.degree(i) if self.S.token[i] else 0
+    
+    # sample() - returns a permitted call chosen uniformly at random
+    #            (every neighbour of the caller is a permitted callee, 
+    #            so the offset of the draw into the weight of the 
+    #            caller picks the callee)
+    def sample(self):
+        (i, k) = self.fenwick.locate(random.randrange(self.fenwick.total))
+        return (i, self.S.neighbour(i, k))
+    
+    # randomOrder() - yields the calls in a uniformly random order (see
+    #                 CallPool.randomOrder)
+    def randomOrder(self):
+        order = self.calls()
+        for end in range(len(order), 0, -1):
+            k = random.randrange(end)
+            call = order[k]
+            order[k] = order[end - 1]
+            yield call
+
+
+# ===============================================================
+#  Call execution
+# ===============================================================
+
+# exchange(S, P, i, j) - executes call (i,j) between agents of S
+# Parameters: S - GossipState of a gossip graph
+#             P - predefined protocol function
+#             i - int, index of caller agent
+#             j - int, index of callee agent
+# Returns: e - int, number of agents (0, 1 or 2) that became experts
+#              as a result of the call
+# Under LNS the secrets newly learned by i and j are recorded in
+# S.learned as a pair, for use by the LNS candidate index. Experts all
+# share the S.full bitset, and on implicit complete topologies contacts
+# are only recorded under CO, so large states stay small.
+
+def exchange(S, P, i, j):
+    # Fetch secrets known before the call
+    secrets = S.secrets
+    secretsI, secretsJ = secrets[i], secrets[j]
+    
+    # Exchange secrets
+    union = secretsI | secretsJ
+    if (union == S.full):
+        union = S.full
+    secrets[i] = secrets[j] = union
+    
+    # Add each agent to each others past contacts
+    if (P == CO or not S.implicit):
+        S.contacts[i] |= 1 << j
+        S.contacts[j] |= 1 << i
+    
+    # Exchange tokens
+    # TOK
+    if (P == TOK):
+        S.token[i] = 0
+        S.token[j] = 1
+    # SPI
+    if (P == SPI):
+        S.token[j] = 0
+    
+    # Record newly learned secrets (the old secrets are a subset of 
+    # the new ones, so the symmetric difference gives the new secrets)
+    if (P == LNS):
+        S.learned = (secrets[i] ^ secretsI, secrets[j] ^ secretsJ)
+    
+    # Indicate S is no longer an initial gossip graph
+    S.initial = False
+    
+    # Count new experts, only i and j can have become experts
+    e = 0
+    if (secrets[i] == S.full):
+        e = (secretsI != S.full) + (secretsJ != S.full)
+    
+    return e
+
+
+# updateArcs(S, P, i, j, calls) - exchanges phone numbers after call
+#                                 (i,j) and adds the resulting arcs
+#                                 (dynamic case only)
+# Parameters: S - GossipState of a gossip digraph
+#             P - predefined protocol function
+#             i - int, index of caller agent
+#             j - int, index of callee agent
+#             calls - CallPool of permitted calls
+# Returns - calls, CallPool of permitted calls including new arcs
+#
+# Each agent has an arc to every number it knows (other than its own),
+# so the new arcs of an agent are the numbers it knows but has no arc
+# to. These are found as a bitset difference and added in bulk, 
+# together with the P permitted calls among them.
+
+def updateArcs(S, P, i, j, calls):
+    # Update phone number lists
+    S.numbers[i] = S.numbers[j] = S.numbers[i] | S.numbers[j]
+
+    # Add new arcs of caller, then callee
+    for agent in (i, j):
+        new = S.numbers[agent] & ~S.out[agent] & ~(1 << agent)
+        if (new == 0):
+            continue
+        S.addArcs(agent, new)
+        
+        # Sampled calls (or TokenPool) - recount the calls of agent
+        if (isinstance(calls, CallSampler)):
+            calls.refresh((agent,))
+            continue
+        
+        # Keep the new arcs that are P permitted calls
+        # CO - agents have not been in contact (contacts are symmetric)
+        if (P == CO):
+            new &= ~S.contacts[agent]
+        # LNS - agent does not know the secret of the number
+        elif (P == LNS):
+            new &= ~S.secrets[agent]
+        
+        # Add new P permitted calls to calls
+        numbers = list(bitsetMembers(new))
+        for number in numbers:
+            calls.append((agent, number))
+        # Add numbers to the LNS candidate index
+        if (P == LNS):
+            S.unknown[agent].update(numbers)
+
+    return calls
+
+
+# ===============================================================
+#  Profiling tools
+# ===============================================================
+
+# PhaseProfile() - accumulates the time spent in, and number of calls 
+#                  to, each phase of the execution functions, per 
+#                  protocol and over any number of executions
+#
+# A PhaseProfile is passed to executeProtocol or executeRounds, which
+# then time each phase (the protocol update, call selection or round
+# scheduling, secret exchange, arc update and stuck check) and the
+# whole execution. Phases are timed by wrapping the functions of the
+# execution once, so an execution without a profile runs exactly the
+# same loop as before.
+
+class PhaseProfile:
+    __slots__ = ('times', 'counts')
+    
+    def __init__(self):
+        # Total time and number of calls of each (protocol, phase)
+        self.times = {}
+        self.counts = {}
+    
+    # add(protocol, phase, elapsed) - records one call of a phase
+    def add(self, protocol, phase, elapsed):
+        key = (protocol, phase)
+        self.times[key] = self.times.get(key, 0.0) + elapsed
+        self.counts[key] = self.counts.get(key, 0) + 1
+    
+    # timed(protocol, phase, f) - wraps function f so that each of its 
+    #                             calls is recorded as a call of phase
+    def timed(self, protocol, phase, f):
+        key = (protocol, phase)
+        self.times.setdefault(key, 0.0)
+        self.counts.setdefault(key, 0)
+        times, counts, clock = self.times, self.counts, time.perf_counter
+        
+        def g(*args):
+            start = clock()
+            result = f(*args)
+            times[key] += clock() - start
+            counts[key] += 1
+            return result
+        return g
+    
+    # report() - returns a dictionary {protocol: {phase: {'time', 
+    #            'count', 'mean'}}} of the recorded phases, where the
+    #            'execution' phase is the whole of each execution
+    def report(self):
+        report = {}
+        for ((protocol, phase), elapsed) in self.times.items():
+            count = self.counts[(protocol, phase)]
+            report.setdefault(protocol, {})[phase] = {
+                'time': elapsed, 'count': count,
+                'mean': elapsed/count if count else None}
+        return report
+    
+    def __repr__(self):
+        lines = ['protocol'.ljust(10)+'phase'.ljust(12)+'time (s)'.rjust(12)
+                 +'count'.rjust(12)+'mean (us)'.rjust(12)]
+        for (protocol, phases) in self.report().items():
+            for (phase, entry) in phases.items():
+                mean = entry['mean'] or 0
+                lines.append(protocol.ljust(10)+phase.ljust(12)+
+                             str(round(entry['time'], 4)).rjust(12)+
+                             str(entry['count']).rjust(12)+
+                             str(round(mean * 1e6, 2)).rjust(12))
+        return '\n'.join(lines)
+
+
+# ===============================================================
+#  Call traces
+# ===============================================================
+
+# CallTrace(calls, rounds) - records the calls made by an execution
+# Parameters: calls - array of shape (k, 2) of ints, initial calls 
+#                     (i,j) of the trace
+#             rounds - list of ints, initial round ends
+#
+# A CallTrace is passed to executeProtocol or executeRounds, which then
+# append each call made to it (as two int32 agent indices) and, for 
+# executeRounds, the number of calls made by the end of each round. 
+# Calls are recorded by wrapping the call execution once, so an 
+# execution without a trace runs exactly the same loop as before.
+
+class CallTrace:
+    __slots__ = ('pairs', 'ends')
+    
+    def __init__(self, calls = (), rounds = ()):
+        # Agents of the calls, caller then callee
+        self.pairs = array('i', np.asarray(calls, dtype=np.int32).ravel())
+        # Number of calls made by the end of each round
+        self.ends = array('i', rounds)
+    
+    def __len__(self):
+        return len(self.pairs)//2
+    
+    def __repr__(self):
+        return ("CallTrace("+str(len(self))+" calls, "+
+                str(len(self.ends))+" rounds)")
+    
+    # record(f) - wraps the call execution f(S, P, i, j) so that each 
+    #             call is appended to the trace
+    def record(self, f):
+        append = self.pairs.append
+        
+        def g(S, P, i, j):
+            append(i)
+            append(j)
+            return f(S, P, i, j)
+        return g
+    
+    # endRound() - records the end of a round
+    def endRound(self):
+        self.ends.append(len(self))
+    
+    # calls() - returns the calls as an int32 array of shape (k, 2)
+    def calls(self):
+        return np.array(self.pairs, dtype=np.int32).reshape(-1, 2)
+    
+    # rounds() - returns the round ends as an int32 array, where the
+    #            first r rounds are the first rounds()[r-1] calls
+    def rounds(self):
+        return np.array(self.ends, dtype=np.int32)
+    
+    # save(path) - saves the trace to a ".npz" file
+    def save(self, path):
+        np.savez(path, calls=self.calls(), rounds=self.rounds())
+
+
+# loadTrace(path) - loads a trace saved by CallTrace.save
+# Parameters: path - string, path of the ".npz" file
+# Returns: CallTrace
+
+def loadTrace(path):
+    with np.load(path, allow_pickle=False) as data:
+        return CallTrace(data['calls'], data['rounds'].tolist())
+
+
+# replayTrace(G, P, trace, stop, check) - re-applies the calls of a 
+#                                         trace to a gossip graph
+# Parameters: G - graph object in the initial state the traced 
+#                 execution started from, or its GossipState
+#             P - predefined protocol function of the traced execution
+#             trace - CallTrace
+#             stop - int, number of calls replayed (None replays all,
+#                    trace.rounds()[r-1] replays the first r rounds)
+#             check - boolean, if true each call is checked to be a P
+#                     permitted call on an arc before it is made
+# Returns: S - GossipState after the replayed calls (a graph G is also
+#              updated with it)
+#
+# Only the calls themselves are executed (secrets, contacts, tokens and,
+# in the dynamic case, numbers and arcs), without maintaining the 
+# permitted calls, so a replay is much faster than the execution. The
+# returned state is meant for inspection rather than further execution.
+
+def replayTrace(G, P, trace, stop = None, check = False):
+    # Fetch compact state of G
+    S = G if isinstance(G, GossipState) else GossipState(G)
+    
+    for (k, (i, j)) in enumerate(trace.calls()[:stop].tolist()):
+        # Check the call is permitted
+        if (check and not ((S.outBits(i) >> j) & 1 and
+                           pPermitted(S, P, i, j))):
+            raise ValueError("call "+str(k)+" "+str((i, j))+
+                             " is not a permitted call")
+        
+        # Execute call
+        exchange(S, P, i, j)
+        
+        # Exchange phone numbers and add new arcs in dynamic case
+        if (S.dynamic):
+            S.numbers[i] = S.numbers[j] = S.numbers[i] | S.numbers[j]
+            for agent in (i, j):
+                new = S.numbers[agent] & ~S.out[agent] & ~(1 << agent)
+                if (new != 0):
+                    S.addArcs(agent, new)
+    
+    # Write final state back into graph G (implicit graphs only hold 
+    # their initial state)
+    if (S is not G and not S.implicit):
+        S.writeTo(G)
+    
+    return S
+
+
+# ===============================================================
+#  Protocol execution function
+# ===============================================================
+
+# executeProtocol(G, P, breakdown, budget, timeLimit, profile, trace) -
+#                  executes protocol P on graph G
+# Parameters: G - graph object, generated in "graph_generator.py", or
+#                 its GossipState (a graph is converted to a GossipState
+#                 for the execution and updated with the final state,
+#                 unless it is an implicit complete graph)
+#             P - function,  returns CallPool of P permitted calls
 #             breakdown - boolean, if true a breakdown of calls made and
 #                         available calls at each stage given 
+#             budget - int, maximum number of calls before the execution
+#                      times out (None uses defaultBudget(n))
+#             timeLimit - float, optional wall-clock limit in seconds,
+#                         a safety net on top of the budget (None for
+#                         no limit)
+#             profile - PhaseProfile the time of each phase is added to
+#                       (None for no profiling)
+#             trace - CallTrace each call made is appended to (None for
+#                     no trace)
 # Returns: c - execution length
 #          timer - execution time
 #          success - boolean, indicates if all agents are experts 
@@ -87,7 +1114,8 @@ def pPermitted(G, P, caller, callee):
 #          failure - boolean, indicates if protocol has failed
 #          timeout - boolean, indicates if protocol has timed out
 
-def executeProtocol(G, P, breakdown = False):
+def executeProtocol(G, P, breakdown = False, budget = None, 
+                    timeLimit = None, profile = None, trace = None):
     # Intitialise number of calls and success boolean
     c, success = 0, False
     # Initialise timeout and failure booleans
@@ -97,98 +1125,116 @@ def executeProtocol(G, P, breakdown = False):
     calls = []
     newcall = 0
     
+    # Fetch compact state of G
+    S = G if isinstance(G, GossipState) else GossipState(G)
+    
+    # Initialise number of agents and number of experts (the expert
+    # count is then updated incrementally by each call)
+    n = S.n
+    e = countExperts(S)
+    
+    # Maximum number of calls
+    if (budget is None):
+        budget = defaultBudget(n)
+    
+    # Number of calls that spread no knowledge since the last check of
+    # whether P is stuck (the check scans all permitted calls, or all 
+    # agents of a CallSampler, so it is only made once there have been
+    # as many such calls as calls or agents scanned, which keeps its 
+    # average cost per call constant)
+    idle = 0
+    detect = P == CO or P == SPI
+    
+    # Phases of each call (replaced by timed wrappers when profiling)
+    update, call, arcs, check = P, exchange, updateArcs, stuck
+    if (profile is not None):
+        name = P.__name__
+        update = profile.timed(name, 'update', P)
+        call = profile.timed(name, 'exchange', exchange)
+        arcs = profile.timed(name, 'arcs', updateArcs)
+        check = profile.timed(name, 'stuck', stuck)
+    # Record each call made in the trace
+    if (trace is not None):
+        call = trace.record(call)
+    
     # Record initial time
     initTime = time.perf_counter()
     
+    # Fetch list of available calls (the protocol then updates the same
+    # pool after each call, so its sample method is bound once)
+    calls = update(S, newcall, calls)
+    select = calls.sample
+    if (profile is not None):
+        select = profile.timed(name, 'select', calls.sample)
+    
     # Execute protocol (each loop corresponds to one call or termination)
     while (True):
         # Check if all agents are experts
-        if (experts(G)):
+        if (e == n):
             success = True
             break
         
-        # Fetch list of available calls
-        calls = P(G, newcall, calls)
+        # Timeout (call budget spent or time limit exceeded; the clock
+        # is only read when a time limit is given)
+        if (c >= budget or (timeLimit is not None and
+                            time.perf_counter() - initTime > timeLimit)):
+            timeout = True
+            break
         
         if (breakdown):
             print("Stage "+str(c + 1))
             print("Available calls: "+str(calls))
         
+        # Fail early if no permitted call can spread knowledge
+        if (detect and idle > 0 and len(calls) != 0 and 
+            idle >= (min(len(calls), n) if isinstance(calls, CallSampler)
+                     else len(calls))):
+            if (check(S, P, calls)):
+                failure = True
+                break
+            idle = 0
+        
         # If calls is non-empty
         if (len(calls) != 0):
             # Select random call
-            newcall = random.choice(calls)
+            newcall = select()
             
             if (breakdown):
                 print("New call: "+str(newcall)+"\n")
             # i is the caller, j is the callee
             i, j = newcall[0], newcall[1]
             
-            # Execute new call
-            
-            # Exchange secrets
-            G.nodes[i]['secrets'] = G.nodes[i]['secrets'].union(
-                                    G.nodes[j]['secrets'])
-            G.nodes[j]['secrets'] = G.nodes[i]['secrets']
+            # Count calls that spread no knowledge
+            if (detect and not spreads(S, i, j)):
+                idle += 1
             
-            # Add each agent to each others past contacts
-            G.nodes[i]['contacts'].add(j)
-            G.nodes[j]['contacts'].add(i)
-            
-            # Exchange tokens
-            # TOK
-            if (P == TOK):
-                G.nodes[i]['token'] = False
-                G.nodes[j]['token'] = True
-            # SPI
-            if (P == SPI):
-                G.nodes[j]['token'] = False
+            # Execute new call
+            e += call(S, P, i, j)
             
             # Increment call counter
             c += 1
             
-            # Indicate G is no longer an initial gossip graph
-            G.graph['initial'] = False
-            
             # Update arcs of G in dynamic case
-            if (type(G) == nx.classes.digraph.DiGraph):
-                # Update phone number lists
-                G.nodes[i]['numbers'] = G.nodes[i]['numbers'].union(
-                                        G.nodes[j]['numbers'])
-                G.nodes[j]['numbers'] = G.nodes[i]['numbers']
-                
-                # Add relevant arcs to graph
-                # Loop through known numbers of caller
-                for number in G.nodes[i]['numbers']:
-                    # Add any new arcs to G
-                    if (((i, number) not in G.edges) and (i != number)):
-                        G.add_edge(i, number)
-                        # Add new P permitted calls to calls
-                        if pPermitted(G, P, i, number):
-                            calls.append((i, number))
-                
-                # Similarly for the callee
-                for number in G.nodes[j]['numbers']:
-                    if (((j, number) not in G.edges) and (j != number)):
-                        G.add_edge(j, number)
-                        # Add new P permitted calls to calls
-                        if pPermitted(G, P, j, number):
-                            calls.append((j, number))
+            if (S.dynamic):
+                calls = arcs(S, P, i, j, calls)
+            
+            # Update list of available calls
+            calls = update(S, newcall, calls)
             
         # Else if calls is empty, break from loop
         elif (len(calls) == 0):
             failure = True
             break
-        
-        # Record current time 
-        curTime = time.perf_counter()
-        # Time elapsed
-        timer = curTime - initTime
-        
-        # Timeout
-        if (timer > G.number_of_nodes()/10):
-            timeout = True
-            break
+    
+    # Time elapsed
+    timer = time.perf_counter() - initTime
+    if (profile is not None):
+        profile.add(P.__name__, 'execution', timer)
+    
+    # Write final state back into graph G (implicit graphs only hold 
+    # their initial state)
+    if (S is not G and not S.implicit):
+        S.writeTo(G)
         
     return (c, timer, success, failure, timeout)
 
@@ -197,12 +1243,56 @@ def executeProtocol(G, P, breakdown = False):
 #  Protocol execution function (rounds variant)
 # ===============================================================
 
-# executeRounds(G, P) - executes protocol P on gossip graph G 
-#                      (in rounds of calls)
-# Parameters: G - graph object, generated in "graph_generator.py"
-#             P - function,  returns list of P permitted calls
+# scheduleRound(calls, n) - chooses the calls of one round
+# Parameters: calls - CallPool of permitted calls at the start of the
+#                     round
+#             n - int, number of agents
+# Returns: list of tuples (i,j), a random maximal set of disjoint calls
+#
+# The calls are scanned in a random order, keeping each call whose 
+# agents have not participated yet, until at most one agent is left to
+# participate.
+
+def scheduleRound(calls, n):
+    # Initialise set of agents that have participated in this round
+    participants = set()
+    
+    chosen = []
+    for newcall in calls.randomOrder():
+        # At most one agent is left to participate
+        if (len(participants) >= (n - 1)):
+            break
+        
+        # If i or j already participated, skip (i,j)
+        i, j = newcall[0], newcall[1]
+        if ((i in participants) or (j in participants)):
+            continue
+        participants.add(i)
+        participants.add(j)
+        chosen.append(newcall)
+    
+    return chosen
+
+
+# executeRounds(G, P, breakdown, budget, timeLimit, profile, trace) - 
+#                executes protocol P on gossip graph G (in rounds of 
+#                calls)
+# Parameters: G - graph object, generated in "graph_generator.py", or
+#                 its GossipState (a graph is converted to a GossipState
+#                 for the execution and updated with the final state)
+#             P - function,  returns CallPool of P permitted calls
 #             breakdown - boolean, if true function will return 
 #                         breakdown of calls made in each round
+#             budget - int, maximum number of rounds before the 
+#                      execution times out (None uses 
+#                      defaultRoundBudget(n))
+#             timeLimit - float, optional wall-clock limit in seconds,
+#                         a safety net on top of the budget (None for
+#                         no limit)
+#             profile - PhaseProfile the time of each phase is added to
+#                       (None for no profiling)
+#             trace - CallTrace each call made, and the end of each 
+#                     round, is appended to (None for no trace)
 # Returns: r - number of rounds performed
 #          timer - execution time
 #          success - boolean, indicates if all agents are experts 
@@ -210,16 +1300,49 @@ def executeProtocol(G, P, breakdown = False):
 #          failure - boolean, indicates if protocol has failed
 #          timeout - boolean, indicates if protocol has timed out
 
-def executeRounds(G, P, breakdown=False):
+def executeRounds(G, P, breakdown=False, budget=None, timeLimit=None,
+                  profile=None, trace=None):
     # Intitialise number of rounds and success boolean
     r, success = 0, False
     # Initialise failure and timeout booleans
     failure, timeout = False, False
     
+    # Fetch compact state of G
+    S = G if isinstance(G, GossipState) else GossipState(G)
+    
+    # Rounds scan every permitted call, which a CallSampler avoids
+    if (S.sampled):
+        raise ValueError("rounds are not supported on sampled states "
+                         "(e.g. implicit complete topologies)")
+    
+    # Phases of each round and call (replaced by timed wrappers when 
+    # profiling)
+    schedule, update, call, arcs, check = (scheduleRound, P, exchange,
+                                           updateArcs, stuck)
+    if (profile is not None):
+        name = P.__name__
+        schedule = profile.timed(name, 'schedule', scheduleRound)
+        update = profile.timed(name, 'update', P)
+        call = profile.timed(name, 'exchange', exchange)
+        arcs = profile.timed(name, 'arcs', updateArcs)
+        check = profile.timed(name, 'stuck', stuck)
+    # Record each call made in the trace
+    if (trace is not None):
+        call = trace.record(call)
+    
     # Initialise list of available calls and newest call
     newcall = 0
     calls = []
-    calls = P(G, newcall, calls)
+    calls = update(S, newcall, calls)
+    
+    # Initialise number of agents and number of experts (the expert
+    # count is then updated incrementally by each call)
+    n = S.n
+    e = countExperts(S)
+    
+    # Maximum number of rounds
+    if (budget is None):
+        budget = defaultRoundBudget(n)
     
     # Record initial time
     initTime = time.perf_counter()
@@ -227,12 +1350,19 @@ def executeRounds(G, P, breakdown=False):
     # Execute protocol (each loop corresponds to one round)
     while (True):
         # Check if all agents are experts
-        if (experts(G)):
+        if (e == n):
             success = True
             break
         
-        # If calls is empty, break from loop
-        if (len(calls) == 0):
+        # Timeout (round budget spent or time limit exceeded)
+        if (r >= budget or (timeLimit is not None and
+                            time.perf_counter() - initTime > timeLimit)):
+            timeout = True
+            break
+        
+        # If calls is empty, or no permitted call can spread 
+        # knowledge, break from loop
+        if (len(calls) == 0 or check(S, P, calls)):
             failure = True
             break
         
@@ -240,99 +1370,43 @@ def executeRounds(G, P, breakdown=False):
             print("Round "+str(r + 1))
             print("Possible calls for this round: "+str(calls))
         
-        # Create copy of available calls
-        roundCalls = copy.deepcopy(calls)
-        # Initialise set of agents that have participated 
-        # in this round
-        participants = set()
-        
         if (breakdown):
             print("Calls chosen this round:")
         
-        # Perform calls whilst list of round calls in non-empty
-        while (len(roundCalls) != 0 and len(participants) < 
-               (G.number_of_nodes() - 1)):
-            # Select random call
-            newcall = random.choice(roundCalls)
-            
+        # Perform the disjoint calls of the round
+        for newcall in schedule(calls, n):
             # i is the caller, j is the callee
             i, j = newcall[0], newcall[1]
-            # If i or j already participated, remove (i,j) from calls 
-            # and select new pair
-            if ((i in participants) or (j in participants)):
-                roundCalls.remove(newcall)
-                continue
-            # Else execute new call
-            else:
-                participants.add(i)
-                participants.add(j)
-                if (breakdown):
-                    print(newcall)
-            
-            # Exchange secrets
-            G.nodes[i]['secrets'] = G.nodes[i]['secrets'].union(
-                                    G.nodes[j]['secrets'])
-            G.nodes[j]['secrets'] = G.nodes[i]['secrets']
-            
-            # Add each agent to each others past contacts
-            G.nodes[i]['contacts'].add(j)
-            G.nodes[j]['contacts'].add(i)
-            
-            # Exchange tokens
-            # TOK
-            if (P == TOK):
-                G.nodes[i]['token'] = False
-                G.nodes[j]['token'] = True
-            # SPI
-            if (P == SPI):
-                G.nodes[j]['token'] = False
+            if (breakdown):
+                print(newcall)
             
-            # Indicate G is no longer an initial gossip graph
-            G.graph['initial'] = False
+            # Execute new call
+            e += call(S, P, i, j)
             
             # Update initial list of calls for next round
-            calls = P(G, newcall, calls)
+            calls = update(S, newcall, calls)
             
             # Update arcs of G in dynamic case
-            if (type(G) == nx.classes.digraph.DiGraph):
-                # Update phone number lists
-                G.nodes[i]['numbers'] = G.nodes[i]['numbers'].union(
-                                        G.nodes[j]['numbers'])
-                G.nodes[j]['numbers'] = G.nodes[i]['numbers']
-                
-                # Add relevant arcs to graph
-                # Loop through known numbers of caller
-                for number in G.nodes[i]['numbers']:
-                    # Add any new arcs to G
-                    if (((i, number) not in G.edges) and (i != number)):
-                        G.add_edge(i, number)
-                        # Add new P permitted calls to calls
-                        if pPermitted(G, P, i, number):
-                            calls.append((i, number))
-                
-                # Similarly for the callee
-                for number in G.nodes[j]['numbers']:
-                    if (((j, number) not in G.edges) and (j != number)):
-                        G.add_edge(j, number)
-                        # Add new P permitted calls to calls
-                        if pPermitted(G, P, j, number):
-                            calls.append((j, number))
+            if (S.dynamic):
+                calls = arcs(S, P, i, j, calls)
             
         if (breakdown):
             print("\n")
     
         # Increment round counter
         r += 1
-        
-        # Record current time 
-        curTime = time.perf_counter()
-        # Time elapsed
-        timer = curTime - initTime
-        
-        # Timeout
-        if (timer > G.number_of_nodes()/10):
-            timeout = True
-            break
+        if (trace is not None):
+            trace.endRound()
+    
+    # Time elapsed
+    timer = time.perf_counter() - initTime
+    if (profile is not None):
+        profile.add(P.__name__, 'execution', timer)
+    
+    # Write final state back into graph G (implicit graphs only hold 
+    # their initial state)
+    if (S is not G and not S.implicit):
+        S.writeTo(G)
         
     return (r, timer, success, failure, timeout)
                 
@@ -342,141 +1416,138 @@ def executeRounds(G, P, breakdown=False):
 #  Individual protocol functions
 # ===============================================================
 
-# ANY(G, newcall, calls) - returns ANY permitted calls for graph G
-# Parameters: G - graph object, generated in "graph_generator.py"
+# ANY(S, newcall, calls) - returns ANY permitted calls for graph S
+# Parameters: S - GossipState of a gossip graph
 #             newcall - tuple, latest call made
-#             calls - list of permitted calls in the previous step
-# Returns - calls, updated list of permitted calls
+#             calls - CallPool of permitted calls in the previous step
+# Returns - calls, updated CallPool of permitted calls
 
-def ANY(G, newcall, calls):
+def ANY(S, newcall, calls):
     
-    # If G is an initial gossip graph, add all edges/arcs from G
-    if (G.graph['initial'] or newcall == 0):
-        H = copy.deepcopy(G)
-        H = nx.DiGraph(H)
-        calls = list(H.edges)
+    # If S is an initial gossip graph, add all edges/arcs from S
+    if (S.initial or newcall == 0):
+        calls = S.initialCalls(ANY)
         
     return calls
 
 
 
 
-# CO(G, newcall, calls) - returns CO permitted calls for graph G
-# Parameters: G - graph object, generated in "graph_generator.py"
+# CO(S, newcall, calls) - returns CO permitted calls for graph S
+# Parameters: S - GossipState of a gossip graph
 #             newcall - tuple, latest call made
-#             calls - list of permitted calls in the previous step
-# Returns - calls, updated list of permitted calls
+#             calls - CallPool of permitted calls in the previous step
+# Returns - calls, updated CallPool of permitted calls
 
-def CO(G, newcall, calls):
+def CO(S, newcall, calls):
+    
+    # If S is an initial gossip graph, add all edges/arcs from S
+    if (S.initial or newcall == 0):
+        calls = S.initialCalls(CO)
     
-    # If G is an initial gossip graph, add all edges/arcs from G
-    if (G.graph['initial'] or newcall == 0):
-        H = copy.deepcopy(G)
-        H = nx.DiGraph(H)
-        calls = list(H.edges)
+    # Sampled calls - recount the calls of i and j
+    elif (S.sampled):
+        calls.refresh(newcall)
     
     # Latest call is (i,j)
-    # If G not initial, remove (i,j) and (j,i) from calls
+    # If S not initial, remove (i,j) and (j,i) from calls
     else:
         calls.remove(newcall)
-        if (newcall[::-1] in calls):
-            calls.remove(newcall[::-1])
+        calls.discard(newcall[::-1])
         
     return calls
 
 
 
-# LNS(G, newcall, calls) - returns LNS permitted calls for graph G
-# Parameters: G - graph object, generated in "graph_generator.py"
+# LNS(S, newcall, calls) - returns LNS permitted calls for graph S
+# Parameters: S - GossipState of a gossip graph
 #             newcall - tuple, latest call made
-#             calls - list of permitted calls in the previous step
-# Returns - calls, updated list of permitted calls
+#             calls - CallPool of permitted calls in the previous step
+# Returns - calls, updated CallPool of permitted calls
+# Each agent holds an index S.unknown[i] of the neighbours k such 
+# that (i,k) is permitted, i.e. whose secret i does not know. After a 
+# call only the newly learned secrets are checked against the index,
+# so the work done is proportional to what the call changed.
 
-def LNS(G, newcall, calls):
+def LNS(S, newcall, calls):
+    
+    # If S is an initial gossip graph, add all edges/arcs from S
+    if (S.initial or newcall == 0):
+        calls = S.initialCalls(LNS)
+        
+        # Build the index of neighbours with unknown secrets
+        if (not S.sampled):
+            S.unknown = [{k for k in S.neighbours(agent) 
+                          if not (S.secrets[agent] >> k) & 1}
+                         for agent in range(S.n)]
     
-    # If G is an initial gossip graph, add all edges/arcs from G
-    if (G.graph['initial'] or newcall == 0):
-        H = copy.deepcopy(G)
-        H = nx.DiGraph(H)
-        calls = list(H.edges)
+    # Sampled calls - recount the calls of i and j
+    elif (S.sampled):
+        calls.refresh(newcall)
     
     # Say the latest call is (i,j)
-    # If G not initial, remove calls (i,k) where i knows k's secret 
-    # Similarly remove calls (j,k) such that j knows k's secret 
+    # If S not initial, remove calls (i,k) where i has just learned 
+    # k's secret. Similarly remove calls (j,k) where j has just learned
+    # k's secret
     else:
-        i = newcall[0]
-        # For each secret k that i knows
-        for secret in G.nodes[i]['secrets']:
-            # Check if (i,k) in calls and remove if so
-            if ((i, secret) in calls):
-                calls.remove((i, secret))
-                
-        j = newcall[1]
-        # For each secret k that j knows
-        for secret in G.nodes[j]['secrets']:
-            # Check if (j,k) in calls and remove if so
-            if ((j, secret) in calls):
-                calls.remove((j, secret)) 
+        for agent, learned in zip(newcall, S.learned):
+            unknown = S.unknown[agent]
+            # Intersect the new secrets with the index, looping 
+            # through whichever of the two is smaller
+            if (learned.bit_count() < len(unknown)):
+                known = [k for k in bitsetMembers(learned) if k in unknown]
+            else:
+                known = [k for k in sorted(unknown) if (learned >> k) & 1]
+            
+            # Remove (agent,k) for each neighbour k whose secret 
+            # is now known
+            for k in known:
+                unknown.remove(k)
+                calls.discard((agent, k))
         
     return calls
     
     
 
-# TOK(G, newcall, calls) - returns TOK permitted calls for graph G
-# Parameters: G - graph object, generated in "graph_generator.py"
+# TOK(S, newcall, calls) - returns TOK permitted calls for graph S
+# Parameters: S - GossipState of a gossip graph
 #             newcall - tuple, latest call made
-#             calls - list of permitted calls in the previous step
-# Returns - calls, updated list of permitted calls
+#             calls - CallPool of permitted calls in the previous step
+# Returns - calls, updated CallPool of permitted calls
 
-def TOK(G, newcall, calls):
+def TOK(S, newcall, calls):
     
-    # If G is an initial gossip graph, add all edges/arcs from G
-    if (G.graph['initial'] or newcall == 0):
-        H = copy.deepcopy(G)
-        H = nx.DiGraph(H)
-        calls = list(H.edges)
+    # If S is an initial gossip graph, add all edges/arcs from S
+    if (S.initial or newcall == 0):
+        calls = S.initialCalls(TOK)
     
     # Say the latest call is (i.j)
-    # If G not initial, remove calls (i,k) where i knows k's number
-    # and add calls (j, k) such that j knows k's number
+    # If S not initial, i may no longer call its neighbours and j may
+    # call all of its neighbours, so recount the calls of i and j in
+    # the TokenPool
     else:
-        i, j = newcall[0], newcall[1]
-        
-        # For each neighbour k of i, remove call (i,k) if it exists
-        for neighbour in G.adj[i]:
-            if ((i, neighbour) in calls):
-                calls.remove((i, neighbour))
-                
-        # For each neighbour k of j, add new calls (j,k)
-        for neighbour in G.adj[j]:
-            if ((j, neighbour) not in calls):
-                calls.append((j, neighbour))
+        calls.refresh(newcall)
         
     return calls
 
 
-# SPI(G, newcall, calls) - returns SPI permitted calls for gossip graph G
-# Parameters: G - graph object, generated in "graph_generator.py"
+# SPI(S, newcall, calls) - returns SPI permitted calls for gossip graph S
+# Parameters: S - GossipState of a gossip graph
 #             newcall - tuple, latest call made
-#             calls - list of permitted calls in the previous step
-# Returns - calls, updated list of permitted calls
+#             calls - CallPool of permitted calls in the previous step
+# Returns - calls, updated CallPool of permitted calls
 
-def SPI(G, newcall, calls):
+def SPI(S, newcall, calls):
     
-    # If G is an initial gossip graph, add all edges/arcs from G
-    if (G.graph['initial'] or newcall == 0):
-        H = copy.deepcopy(G)
-        H = nx.DiGraph(H)
-        calls = list(H.edges)
+    # If S is an initial gossip graph, add all edges/arcs from S
+    if (S.initial or newcall == 0):
+        calls = S.initialCalls(SPI)
     
     # Say the latest call is (i.j)
-    # If G not initial, remove calls (j,k) such that j knows k's number
+    # If S not initial, j may no longer call its neighbours, so recount
+    # the calls of j in the TokenPool
     else:
-        j = newcall[1]
-        # For each neighbour k of j, remove call (j,k) if it exists
-        for neighbour in G.adj[j]:
-            if ((j, neighbour) in calls):
-                calls.remove((j, neighbour))
+        calls.refresh(newcall[1:])
         
     return calls
 
@@ -0,0 +1,193 @@
+'''This file contains functions to store the results of every trial of
+an experiment in a columnar file (a NumPy structured array), and to
+rebuild the average and rate dictionaries of the experiment function
+from it.'''
+
+# Install modules
+import networkx as nx
+import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.rcParams["figure.dpi"] = 150
+import numpy as np
+from math import factorial
+import random
+import time
+import copy
+import pickle
+import json
+
+# ===============================================================
+#  Trial records
+# ===============================================================
+
+# Network topologies, in the order of their codes
+TOPOLOGIES = ['complete', 'incomplete', 'dynamic']
+
+# Fields of a trial record (one row per trial). The topology and 
+# protocol are stored as their indices in TOPOLOGIES and PROTOCOLS, the
+# seed is the master seed of the trial (0 if it was unseeded), the 
+# length is the number of calls (or rounds) and the time is in seconds.
+TRIAL_DTYPE = np.dtype([('top', 'i1'), ('rounds', '?'), ('n', '<i4'),
+                        ('protocol', 'i1'), ('trial', '<i4'),
+                        ('seed', '<u8'), ('length', '<i8'),
+                        ('time', '<f8'), ('success', '?'),
+                        ('failure', '?'), ('timeout', '?')])
+
+
+# recordsToTrials(records) - packs trial records into a structured array
+# Parameters: records - list of dictionaries, as written by writeRecord
+#                       in "experiments.py"
+# Returns: NumPy structured array of dtype TRIAL_DTYPE, one row per
+#          record
+
+def recordsToTrials(records):
+    trials = np.zeros(len(records), dtype=TRIAL_DTYPE)
+    for name in TRIAL_DTYPE.names:
+        column = [record[name] for record in records]
+        if (name == 'top'):
+            column = [TOPOLOGIES.index(top) for top in column]
+        elif (name == 'protocol'):
+            column = [PROTOCOLS.index(protocol) for protocol in column]
+        elif (name == 'seed'):
+            column = [0 if seed is None else seed for seed in column]
+        trials[name] = column
+    return trials
+
+
+# loadRecords(path) - reads all trial records of a results file
+# Parameters: path - string, path of a results file written by
+#                    testProtocols (one JSON record per line)
+# Returns: NumPy structured array of dtype TRIAL_DTYPE
+#
+# Lines that cannot be parsed (e.g. cut short by an interrupted sweep)
+# are skipped.
+
+def loadRecords(path):
+    records = []
+    with open(path) as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return recordsToTrials(records)
+
+
+# ===============================================================
+#  Columnar files
+# ===============================================================
+
+# saveTrials(path, trials) - saves trials to a columnar file
+# Parameters: path - string, path of the file (".npy")
+#             trials - NumPy structured array of dtype TRIAL_DTYPE
+# Returns: nothing
+
+def saveTrials(path, trials):
+    np.save(path, np.asarray(trials, dtype=TRIAL_DTYPE),
+            allow_pickle=False)
+
+
+# loadTrials(path, mmap) - loads trials from a columnar file
+# Parameters: path - string, path of a file written by saveTrials
+#             mmap - boolean, if true the file is memory-mapped
+#                    (read-only) rather than read into memory
+# Returns: NumPy structured array of dtype TRIAL_DTYPE
+#
+# Only the array header and raw columns are read, so no pickled code is
+# ever run and a memory-mapped load takes the same time for any number
+# of trials.
+
+def loadTrials(path, mmap = True):
+    return np.load(path, mmap_mode='r' if mmap else None,
+                   allow_pickle=False)
+
+
+# ===============================================================
+#  Summaries
+# ===============================================================
+
+# summarise(trials, top, rounds, seed) - rebuilds the results returned
+#                                        by experiment from stored 
+#                                        trials
+# Parameters: trials - NumPy structured array of dtype TRIAL_DTYPE
+#             top - network topology (complete, incomplete, dynamic)
+#             rounds - boolean, calls made in rounds (true) or not
+#             seed - int, master seed of the trials summarised (None 
+#                    uses the seed of the first stored trial of each n,
+#                    as testProtocols does when resuming)
+# Returns: tuple (lengths, times, successRates, failureRates,
+#          timeoutRates) of dictionaries {protocol: [value per n]},
+#          with n increasing, as returned by experiment (average
+#          lengths and times are over successful trials, and averages
+#          and rates are None if there are none)
+#
+# A results file run with several seeds holds the trials of each, and
+# a trial recorded twice is counted once (its last record), so the 
+# summary of a file agrees with the results of testProtocols on it.
+# Trials are grouped by (protocol, n) with a single bincount per 
+# column, so a summary of a million trials takes milliseconds.
+
+def summarise(trials, top, rounds = False, seed = None):
+    # Select trials of the sweep
+    keep = np.flatnonzero((trials['top'] == TOPOLOGIES.index(top)) &
+                          (trials['rounds'] == rounds))
+    
+    # Select trials of the seed (of each n)
+    seeds = trials['seed'][keep]
+    if (seed is None):
+        (values, first) = np.unique(trials['n'][keep], return_index=True)
+        seed = seeds[first][np.searchsorted(values, trials['n'][keep])]
+    keep = keep[seeds == seed]
+    
+    # Keep the last record of each (protocol, n, trial)
+    keys = np.stack([trials['protocol'][keep], trials['n'][keep], 
+                     trials['trial'][keep]], axis=1)[::-1]
+    last = np.unique(keys, axis=0, return_index=True)[1]
+    keep = np.sort(keep[::-1][last])
+    
+    # Index of each trial's n (in increasing order)
+    n = trials['n'][keep]
+    present = np.bincount(n) > 0
+    size = int(present.sum())
+    nIndex = np.cumsum(present)[n] - 1
+    
+    # Group of each trial, by protocol and then n
+    group = trials['protocol'][keep].astype(np.int64) * size + nIndex
+    groups = len(PROTOCOLS) * size
+    
+    # Numbers of successes, failures and timeouts (outcomes 0, 1 and 2)
+    # and of trials per group
+    outcome = (trials['failure'][keep] + 
+               2 * trials['timeout'][keep].astype(np.int64))
+    numbers = np.bincount(3 * group + outcome, minlength=3 * groups)
+    (sNumber, fNumber, tNumber) = numbers.reshape(groups, 3).T
+    count = sNumber + fNumber + tNumber
+    
+    # Totals of successful lengths and times per group
+    success = trials['success'][keep]
+    sLength = np.bincount(group[success], trials['length'][keep][success],
+                          minlength=groups)
+    sTime = np.bincount(group[success], trials['time'][keep][success],
+                        minlength=groups)
+    
+    # Averages (None without successes) and rates (None without 
+    # trials) per group
+    avgLength = [float(l/s) if s else None 
+                 for (l, s) in zip(sLength, sNumber)]
+    avgTime = [float(t/s) if s else None for (t, s) in zip(sTime, sNumber)]
+    (sRate, fRate, tRate) = ([float(k/c) if c else None 
+                              for (k, c) in zip(number, count)]
+                             for number in (sNumber, fNumber, tNumber))
+    
+    # Split each into dictionaries {protocol: [value per n]}
+    (lengths, times, successRates, failureRates, timeoutRates) = (
+        {}, {}, {}, {}, {})
+    for (p, name) in enumerate(PROTOCOLS):
+        part = slice(p * size, (p + 1) * size)
+        lengths[name] = avgLength[part]
+        times[name] = avgTime[part]
+        successRates[name] = sRate[part]
+        failureRates[name] = fRate[part]
+        timeoutRates[name] = tRate[part]
+    
+    return (lengths, times, successRates, failureRates, timeoutRates)
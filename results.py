@@ -1,6 +1,9 @@
 '''This file contains code that utilises the experiment functions
 to produce and plot the desired results. Note that running this file
-will attempt to save the results to the current working directory.'''
+will attempt to save the results to the current working directory.
+Each sweep also streams its trials to a ".jsonl" file as they complete,
+so rerunning an interrupted sweep resumes it from that file, and every
+trial is then saved to a columnar ".npy" file (see "result_store.py").'''
 
 # Install modules
 import networkx as nx
@@ -20,13 +23,14 @@ import pickle
 # =============================================================================
 
 # 100 agents max, complete topology, 10 trials for each value of n
-completeResults = experiment(100, 'complete', 10)
+completeResults = experiment(100, 'complete', 10,
+                             path="completeResults.jsonl")
 
-# Save data to file
-pickle.dump(completeResults, open("completeResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("completeResults.npy", loadRecords("completeResults.jsonl"))
 
-# Load data from file
-completeResults = pickle.load(open("completeResults.data", "rb"))
+# Load trials from file and rebuild results
+completeResults = summarise(loadTrials("completeResults.npy"), 'complete')
 completeExecutionLengths = completeResults[0]
 completeExecutionTimes = completeResults[1]
 completeSuccessRates = completeResults[2]
@@ -125,13 +129,14 @@ plt.show()
 # =============================================================================
         
 # 100 agents max, incomplete topology, 10 trials for each value of n
-incompleteResults = experiment(100, 'incomplete', 10)
+incompleteResults = experiment(100, 'incomplete', 10,
+                               path="incompleteResults.jsonl")
 
-# Save data to file
-pickle.dump(incompleteResults, open("incompleteResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("incompleteResults.npy", loadRecords("incompleteResults.jsonl"))
 
-# Load data from file
-incompleteResults = pickle.load(open("incompleteResults.data", "rb"))
+# Load trials from file and rebuild results
+incompleteResults = summarise(loadTrials("incompleteResults.npy"), 'incomplete')
 incompleteExecutionLengths = incompleteResults[0]
 incompleteExecutionTimes = incompleteResults[1]
 incompleteSuccessRates = incompleteResults[2]
@@ -227,13 +232,14 @@ plt.show()
 # =============================================================================
 
 # 100 agents max, digraph (dynamic) topology, 10 trials for each value of n
-dynamicResults = experiment(100, 'dynamic', 10)
+dynamicResults = experiment(100, 'dynamic', 10,
+                            path="dynamicResults.jsonl")
 
-# Save data to file
-pickle.dump(dynamicResults, open("dynamicResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("dynamicResults.npy", loadRecords("dynamicResults.jsonl"))
 
-# Load data from file
-dynamicResults = pickle.load(open("dynamicResults.data", "rb"))
+# Load trials from file and rebuild results
+dynamicResults = summarise(loadTrials("dynamicResults.npy"), 'dynamic')
 dynamicExecutionLengths = dynamicResults[0]
 dynamicExecutionTimes = dynamicResults[1]
 dynamicSuccessRates = dynamicResults[2]
@@ -328,13 +334,14 @@ plt.show()
 #  Complete Topology Results (Rounds)
 # =============================================================================
 
-completeRoundResults = experiment(100, 'complete', 10, True)
+completeRoundResults = experiment(100, 'complete', 10, True,
+                                  path="completeRoundResults.jsonl")
 
-# Save data to file
-pickle.dump(completeRoundResults, open("completeRoundResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("completeRoundResults.npy", loadRecords("completeRoundResults.jsonl"))
 
-# Load data from file
-completeRoundResults = pickle.load(open("completeRoundResults.data", "rb"))
+# Load trials from file and rebuild results
+completeRoundResults = summarise(loadTrials("completeRoundResults.npy"), 'complete', True)
 completeRoundLengths = completeRoundResults[0]
 completeTimes = completeRoundResults[1]
 completeSuccessRates = completeRoundResults[2]
@@ -416,13 +423,14 @@ plt.show()
 #  Incomplete Topology Results (Rounds)
 # =============================================================================
         
-incompleteRoundResults = experiment(100, 'incomplete', 10, True)
+incompleteRoundResults = experiment(100, 'incomplete', 10, True,
+                                    path="incompleteRoundResults.jsonl")
 
-# Save data to file
-pickle.dump(incompleteRoundResults, open("incompleteRoundResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("incompleteRoundResults.npy", loadRecords("incompleteRoundResults.jsonl"))
 
-# Load data from file
-incompleteRoundResults = pickle.load(open("incompleteRoundResults.data", "rb"))
+# Load trials from file and rebuild results
+incompleteRoundResults = summarise(loadTrials("incompleteRoundResults.npy"), 'incomplete', True)
 incompleteRoundLengths = incompleteRoundResults[0]
 incompleteTimes = incompleteRoundResults[1]
 incompleteSuccessRates = incompleteRoundResults[2]
@@ -494,13 +502,14 @@ plt.show()
 #  Dynamic Topology Results (Rounds)
 # =============================================================================
 
-dynamicRoundResults = experiment(100, 'dynamic', 10, True)
+dynamicRoundResults = experiment(100, 'dynamic', 10, True,
+                                 path="dynamicRoundResults.jsonl")
 
-# Save data to file
-pickle.dump(dynamicRoundResults, open("dynamicRoundResults.data", "wb"))
+# Save every trial to a columnar file
+saveTrials("dynamicRoundResults.npy", loadRecords("dynamicRoundResults.jsonl"))
 
-# Load data from file
-dynamicRoundResults = pickle.load(open("dynamicRoundResults.data", "rb"))
+# Load trials from file and rebuild results
+dynamicRoundResults = summarise(loadTrials("dynamicRoundResults.npy"), 'dynamic', True)
 dynamicRoundLengths = dynamicRoundResults[0]
 dynamicTimes = dynamicRoundResults[1]
 dynamicSuccessRates = dynamicRoundResults[2]